@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import yaml
+
+import offload
+import persistence
+
+administrators_file = 'administrators.yml'
+blacklist_file = 'blacklist.yml'
+whitelist_file = 'whitelist.yml'
+requests_file = 'requests.yml'
+subscriptions_file = 'subscriptions.yml'
+
+CHECK_INTERVAL = 1.0
+
+
+def read(filename: str) -> Dict[int, str]:
+    try:
+        with open(filename, encoding='UTF-8') as file:
+            return yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def load(filename: str) -> Dict[int, str]:
+    try:
+        size = os.stat(filename).st_size
+    except FileNotFoundError:
+        return {}
+    if offload.pool.enabled and size >= offload.YAML_BYTES:
+        return offload.run(read, filename)
+    return read(filename)
+
+
+def modification_time(filename: str) -> Optional[int]:
+    try:
+        return os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class UserList:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._users: Dict[int, str] = {}
+        self._mtime: Optional[int] = None
+        self._checked = float('-inf')
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return f"UserList({self.filename!r})"
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked = now
+            mtime = modification_time(self.filename)
+            if mtime != self._mtime and not self._dirty:
+                self._users = load(self.filename)
+                self._mtime = mtime
+                logging.info(f"Loaded {len(self._users)} users from {self.filename}.")
+
+    def _mark_dirty(self) -> None:
+        self._dirty = True
+        persistence.writer.schedule(self)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            persistence.dump_atomic(self.filename, self._users)
+            self._mtime = modification_time(self.filename)
+            self._dirty = False
+
+    def __contains__(self, user_id: int) -> bool:
+        self._refresh()
+        return user_id in self._users
+
+    def __iter__(self):
+        self._refresh()
+        return iter(list(self._users))
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._users)
+
+    def users(self) -> Dict[int, str]:
+        self._refresh()
+        return dict(self._users)
+
+    def add(self, user_id: int, name: str) -> None:
+        self._refresh()
+        with self._lock:
+            if self._users.get(user_id) != name:
+                self._users[user_id] = name
+                self._mark_dirty()
+
+    def remove(self, user_id: int) -> None:
+        self._refresh()
+        with self._lock:
+            if user_id in self._users:
+                self._users.pop(user_id)
+                self._mark_dirty()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._checked = float('-inf')
+            self._mtime = None
+        self._refresh()
+
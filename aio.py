@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+import config
+
+settings = config.section('execution')
+
+MODE = settings.get('mode', 'threads')
+WORKERS = settings.get('workers', 4)
+
+loop: Optional[asyncio.AbstractEventLoop] = None
+thread: Optional[threading.Thread] = None
+
+
+def running() -> bool:
+    return loop is not None and loop.is_running()
+
+
+def start() -> None:
+    global loop, thread
+    if loop is not None:
+        return
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run() -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(started.set)
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, name='asyncio', daemon=True)
+    thread.start()
+    started.wait()
+    logging.info("Started asyncio event loop.")
+
+
+def _log_exception(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logging.error("Unhandled exception in coroutine.", exc_info=future.exception())
+
+
+def submit(coroutine: Coroutine) -> Future:
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    future.add_done_callback(_log_exception)
+    return future
+
+
+def run(coroutine: Coroutine, timeout: float = None) -> Any:
+    return submit(coroutine).result(timeout=timeout)
+
+
+def stop() -> None:
+    global loop, thread
+    if loop is None:
+        return
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    loop = thread = None
@@ -0,0 +1,121 @@
+import argparse
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import models
+import top_secret
+
+WORDS = ['hello', 'quote', 'brain', 'coffee', 'meeting', 'lunch', 'deadline', 'magic', 'secret', 'again']
+
+
+def generate_quotes(count: int, persons: int = 200, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    people = [{'id': person_id, 'firstName': f'First{person_id}', 'lastName': f'Last{person_id}'}
+              for person_id in range(1, persons + 1)]
+    quotes = [{'id': quote_id,
+               'quote': f"Quote number {quote_id} about {rng.choice(['coffee', 'deadlines', 'code', 'lunch'])}.",
+               'quotedPersons': rng.sample(people, rng.randint(1, 3)),
+               'brain': rng.randint(0, 100),
+               'quoter': rng.choice(people),
+               'date': f'2019-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}'}
+              for quote_id in range(1, count + 1)]
+    return json.dumps(quotes).encode()
+
+
+def measure(build: Callable[[], Any]) -> Tuple[Any, int, float]:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def memory(count: int) -> List[Dict[str, Any]]:
+    payload = generate_quotes(count)
+    results = []
+    for name, build in [('dict', lambda: json.loads(payload)),
+                        ('model', lambda: models.Decoder().quotes(json.loads(payload)))]:
+        quotes, size, elapsed = measure(build)
+        results.append({'name': name,
+                        'quotes': len(quotes),
+                        'bytes': size,
+                        'bytes_per_quote': size / len(quotes),
+                        'seconds': elapsed})
+        del quotes
+    return results
+
+
+def generate_secrets(texts: int = 200, phrases: int = 50, stickers: int = 50, seed: int = 0) -> Dict:
+    rng = random.Random(seed)
+    return {'texts': {f'secret {number}': f'answer {number}' for number in range(texts)},
+            'phrases': {f'magic {rng.choice(WORDS)} {number}': f'phrase {number}' for number in range(phrases)},
+            'stickers': {f'sticker{number}': f'reply{number}' for number in range(stickers)}}
+
+
+def generate_messages(count: int, texts: int = 200, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    stream = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.05:
+            stream.append(f'Secret {rng.randrange(texts)}?!')
+        elif roll < 0.07:
+            stream.append(rng.choice(['', '?', '...', '!!!']))
+        else:
+            stream.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 25))) + rng.choice(['', '.', '?']))
+    return stream
+
+
+def legacy_secret(filename: str, text: str) -> Any:
+    while text and text[-1] in "?!.":
+        text = text[:-1]
+    secrets = top_secret.read(filename)['texts']
+    return secrets.get(text.lower())
+
+
+def secrets(count: int) -> List[Dict[str, Any]]:
+    stream = generate_messages(count)
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as file:
+        json.dump(generate_secrets(), file)
+    try:
+        engine = top_secret.Secrets(file.name)
+        results = []
+        legacy_count = min(count, 2000)
+        for name, match, messages in [('legacy', lambda text: legacy_secret(file.name, text), stream[:legacy_count]),
+                                      ('engine', engine.text, stream)]:
+            start = time.perf_counter()
+            matches = sum(1 for text in messages if match(text) is not None)
+            elapsed = time.perf_counter() - start
+            results.append({'name': name,
+                            'messages': len(messages),
+                            'matches': matches,
+                            'us_per_message': elapsed / len(messages) * 1e6})
+        return results
+    finally:
+        os.unlink(file.name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', nargs='?', default='memory', choices=['memory', 'secrets'])
+    parser.add_argument('--quotes', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.benchmark == 'memory':
+        for result in memory(args.quotes):
+            print(f"{result['name']:>6}: {result['quotes']} quotes, {result['bytes'] / 2 ** 20:.1f} MiB "
+                  f"({result['bytes_per_quote']:.0f} B/quote), decoded in {result['seconds']:.2f}s")
+    else:
+        for result in secrets(args.messages):
+            print(f"{result['name']:>6}: {result['messages']} messages, {result['matches']} matches, "
+                  f"{result['us_per_message']:.1f} us/message")
@@ -2,121 +2,108 @@ import logging
 import random
 import re
 import threading
-from datetime import time
-from typing import Dict, Tuple, Callable
+from concurrent import futures
+from typing import List, Optional
 
-import yaml
-from telegram import Update, InlineKeyboardButton, Message, InlineKeyboardMarkup, CallbackQuery
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from telegram.error import Unauthorized, BadRequest
-from telegram.ext import CommandHandler, CallbackContext, Job, CallbackQueryHandler, Updater, MessageHandler, Filters
-from telegram.utils.promise import Promise
+from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler, Updater, MessageHandler, Filters
 
+import aio
+import breaker
+import cluster
+import config
+import logs
 import messages
+import metrics
+import notify
+import offload
+import pagination
+import quotestore
 import restapiservice
+import sendqueue
+import storage
+import sync
+import throttle
+import webhook
+from fanout import FanOut
+from models import Person
 from top_secret import top_secret_text_handler, top_secret_sticker_handler
 from utils import send_text_async, command_handler, edit_async, query_handler, send_admins_async, admin_command_handler, \
-    whitelist, blacklist, admin_query_handler, remove_markup
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ])
+    whitelist, blacklist, admin_query_handler, remove_markup, reply_async, reply_stats
 
 PAGE_SIZE = 5
 
-subscriptions: Dict[int, Tuple[Job, str]] = {}
-subscriptions_file = 'subscriptions.yml'
-token_file = 'token.txt'
+shutdown_lock = threading.Lock()
+shut_down = False
 
 
 def load_subscriptions() -> None:
-    with open(subscriptions_file) as s_file:
-        subs = yaml.safe_load(s_file)
-    if not subs:
-        return
-    for chat_id, raw_time in subs.items():
-        [hour, minute] = [int(x) for x in raw_time.split(':')]
-        job = updater.job_queue.run_daily(callback=send_quote_of_the_day_to_chat(chat_id),
-                                          time=time(hour=hour,
-                                                    minute=minute))
-        subscriptions[chat_id] = job, raw_time
+    for chat_id, raw_time in storage.backend.subscriptions().items():
+        subscriptions.add(chat_id=chat_id,
+                          raw_time=raw_time)
+    subscriptions.start(updater.job_queue)
 
 
-def save_subscriptions() -> None:
-    subs = {}
-    for chat_id in subscriptions:
-        subs[chat_id] = subscriptions[chat_id][1]
-    with open(subscriptions_file, mode='w') as s_file:
-        yaml.safe_dump(subs, s_file)
+def send_quote_of_the_day(chat_id: int, context: CallbackContext, update: Update = None) -> None:
+    reply_async(context=context,
+                chat_id=chat_id,
+                name='quoteoftheday',
+                fetch=restapiservice.get_quote_of_the_day,
+                fetch_async=restapiservice.get_quote_of_the_day_async,
+                render=messages.QUOTE_OF_THE_DAY,
+                update=update,
+                dispatcher=dispatcher)
 
 
-def send_quote_of_the_day(chat_id: int, context: CallbackContext) -> None:
-    message_async: Promise = send_text_async(bot=context.bot,
-                                             chat_id=chat_id,
-                                             text=messages.LOADING)
+def render_quote_of_the_day() -> str:
+    return messages.QUOTE_OF_THE_DAY(restapiservice.get_quote_of_the_day())
 
-    quote = restapiservice.get_quote_of_the_day()
 
-    message: Message = message_async.result()
-    del message_async
-    edit_async(text=messages.QUOTE_OF_THE_DAY(quote),
-               bot=context.bot,
-               message=message,
-               disable_web_page_preview=True)
+def deliver_quote_of_the_day(bot: Bot, chat_id: int, text: str) -> None:
+    send_text_async(bot=bot,
+                    chat_id=chat_id,
+                    text=text,
+                    disable_web_page_preview=True,
+                    priority=sendqueue.BROADCAST)
 
 
-def send_quote_of_the_day_to_chat(chat_id: int) -> Callable[[CallbackContext], None]:
-    def fun(ctxt: CallbackContext) -> None:
-        send_quote_of_the_day(chat_id, ctxt)
-
-    return fun
+subscriptions = FanOut(render=render_quote_of_the_day,
+                       deliver=deliver_quote_of_the_day,
+                       claim=cluster.claim_slot)
 
 
 @command_handler
 def quotes_handler(update: Update, context: CallbackContext) -> None:
-    message_async: Promise = send_text_async(bot=context.bot,
-                                             chat_id=update.message.chat_id,
-                                             text=messages.LOADING)
-
-    count = restapiservice.get_quotes_count(context.args)
-    pages = int((count + PAGE_SIZE - 1) / PAGE_SIZE)
-
-    message: Message = message_async.result()
-    edit_async(text=messages.QUOTES_FOUND(count),
-               bot=context.bot,
-               message=message)
-
-    if count > 0:
-        message_async: Promise = send_text_async(bot=context.bot,
-                                                 chat_id=update.message.chat_id,
-                                                 text=messages.LOADING)
-
-        quotes = restapiservice.get_quotes(context.args, 1, PAGE_SIZE)
-
-        markup = None
-        if pages > 1:
-            keyboard = [[InlineKeyboardButton(text="next",
-                                              callback_data=f'Q2;{pages}'),
-                         InlineKeyboardButton(text="last",
-                                              callback_data=f'Q{pages};{pages}')]]
-
-            markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-        message: Message = message_async.result()
-        del message_async
-
-        edit_async(text=messages.QUOTES(quotes),
-                   bot=context.bot,
-                   message=message,
-                   reply_markup=markup)
+    def send_first_page(query: pagination.Query) -> None:
+        if query.count > 0:
+            reply_async(context=context,
+                        chat_id=update.message.chat_id,
+                        name='quotes',
+                        fetch=lambda: pagination.get_page(query, 1, PAGE_SIZE),
+                        fetch_async=lambda: pagination.get_page_async(query, 1, PAGE_SIZE),
+                        render=messages.QUOTES,
+                        markup=lambda quotes: quotes_page_markup(query, 1),
+                        then=lambda quotes: pagination.prefetch(query, 1, PAGE_SIZE),
+                        update=update,
+                        dispatcher=dispatcher)
+
+    reply_async(context=context,
+                chat_id=update.message.chat_id,
+                name='quotes_count',
+                fetch=lambda: pagination.open_query(context.args),
+                fetch_async=lambda: pagination.open_query_async(context.args),
+                render=lambda query: messages.QUOTES_FOUND(query.count),
+                then=send_first_page,
+                update=update,
+                dispatcher=dispatcher)
 
 
 @command_handler
 def quote_of_the_day_handler(update: Update, context: CallbackContext) -> None:
     send_quote_of_the_day(chat_id=update.message.chat_id,
-                          context=context)
+                          context=context,
+                          update=update)
 
 
 @command_handler
@@ -124,32 +111,27 @@ def quote_handler(update: Update, context: CallbackContext) -> None:
     pass
 
 
-@command_handler
-def persons_handler(update: Update, context: CallbackContext) -> None:
-    message_async: Promise = send_text_async(bot=context.bot,
-                                             chat_id=update.message.chat_id,
-                                             text=messages.LOADING)
-
-    persons = restapiservice.get_persons(context.args)
-    count = len(persons)
+def persons_markup(persons: List[Person]) -> Optional[InlineKeyboardMarkup]:
+    if not persons:
+        return None
+    keyboard = []
+    for person in persons:
+        keyboard.append([InlineKeyboardButton(text=person.name,
+                                              callback_data=f'P{person.id}')])
+    return InlineKeyboardMarkup(keyboard)
 
-    markup = None
 
-    if count > 0:
-        keyboard = []
-        for person in persons:
-            person_id = person['id']
-            first_name = person['firstName']
-            last_name = person['lastName']
-            keyboard.append([InlineKeyboardButton(text=f"{first_name} {last_name}",
-                                                  callback_data=f'P{person_id}')])
-        markup = InlineKeyboardMarkup(keyboard)
-
-    message: Message = message_async.result()
-    edit_async(text=messages.PERSONS_FOUND(count),
-               bot=context.bot,
-               message=message,
-               reply_markup=markup)
+@command_handler
+def persons_handler(update: Update, context: CallbackContext) -> None:
+    reply_async(context=context,
+                chat_id=update.message.chat_id,
+                name='persons',
+                fetch=lambda: restapiservice.get_persons(context.args),
+                fetch_async=lambda: restapiservice.get_persons_async(context.args),
+                render=lambda persons: messages.PERSONS_FOUND(len(persons)),
+                markup=persons_markup,
+                update=update,
+                dispatcher=dispatcher)
 
 
 @command_handler
@@ -161,9 +143,9 @@ def subscribe_handler(update: Update, context: CallbackContext) -> None:
         return
 
     raw_time = context.args[0]
-    user_id = update.message.from_user.id
+    chat_id = update.message.chat_id
 
-    if user_id in subscriptions and raw_time == subscriptions[user_id][1]:
+    if subscriptions.get(chat_id) == raw_time:
         send_text_async(bot=context.bot,
                         chat_id=update.message.chat_id,
                         text=messages.ALREADY_SUBSCRIBED(raw_time))
@@ -188,19 +170,15 @@ def subscribe_handler(update: Update, context: CallbackContext) -> None:
                         text=messages.INVALID_MINUTE)
         return
 
-    if user_id in subscriptions:
-        job, sub_time = subscriptions[user_id]
-        job.schedule_removal()
-
+    sub_time = subscriptions.add(chat_id=chat_id,
+                                 raw_time=raw_time)
+    if sub_time is not None:
         send_text_async(bot=context.bot,
                         chat_id=update.message.chat_id,
                         text=messages.SUBSCRIPTION_REMOVED(sub_time))
 
-    job = context.job_queue.run_daily(callback=send_quote_of_the_day_to_chat(update.message.chat_id),
-                                      time=time(hour=hour,
-                                                minute=minute))
-    subscriptions[user_id] = job, raw_time
-    save_subscriptions()
+    storage.backend.subscribe(chat_id=chat_id,
+                              raw_time=raw_time)
 
     send_text_async(bot=context.bot,
                     chat_id=update.message.chat_id,
@@ -209,17 +187,15 @@ def subscribe_handler(update: Update, context: CallbackContext) -> None:
 
 @command_handler
 def unsubscribe_handler(update: Update, context: CallbackContext) -> None:
-    user_id = update.message.from_user.id
-    if user_id not in subscriptions:
+    chat_id = update.message.chat_id
+    sub_time = subscriptions.remove(chat_id=chat_id)
+    if sub_time is None:
         send_text_async(bot=context.bot,
                         chat_id=update.message.chat_id,
                         text=messages.NOT_SUBSCRIBED)
         return
 
-    job, sub_time = subscriptions[user_id]
-    job.schedule_removal()
-    subscriptions.pop(user_id)
-    save_subscriptions()
+    storage.backend.unsubscribe(chat_id=chat_id)
     send_text_async(bot=context.bot,
                     chat_id=update.message.chat_id,
                     text=messages.SUBSCRIPTION_REMOVED(sub_time))
@@ -227,18 +203,14 @@ def unsubscribe_handler(update: Update, context: CallbackContext) -> None:
 
 @command_handler
 def random_handler(update: Update, context: CallbackContext) -> None:
-    message_async: Promise = send_text_async(bot=context.bot,
-                                             chat_id=update.message.chat_id,
-                                             text=messages.LOADING)
-
-    quote = restapiservice.get_quote_random(context.args)
-
-    message: Message = message_async.result()
-    del message_async
-    edit_async(text=messages.QUOTE(quote),
-               bot=context.bot,
-               message=message,
-               disable_web_page_preview=True)
+    reply_async(context=context,
+                chat_id=update.message.chat_id,
+                name='random',
+                fetch=lambda: restapiservice.get_quote_random(context.args),
+                fetch_async=lambda: restapiservice.get_quote_random_async(context.args),
+                render=lambda quote: messages.QUOTE(quote) if quote else messages.QUOTES_FOUND(0),
+                update=update,
+                dispatcher=dispatcher)
 
 
 @command_handler
@@ -250,36 +222,50 @@ def help_handler(update: Update, context: CallbackContext) -> None:
 
 @query_handler
 def quotes_page_handler(update: Update, context: CallbackContext) -> None:
-    query: CallbackQuery = update.callback_query
-
-    edit_async(text=messages.LOADING,
-               bot=context.bot,
-               message=query.message,
-               reply_markup=None)
+    callback_query: CallbackQuery = update.callback_query
 
-    [page, pages] = [int(x) for x in query.data[1:].split(';')]
+    query_fingerprint, page = pagination.parse(callback_query.data)
+    query = pagination.find(query_fingerprint)
+    if query is None:
+        edit_async(text=messages.SEARCH_EXPIRED,
+                   bot=context.bot,
+                   message=callback_query.message)
+        return
 
-    quotes = restapiservice.get_quotes(context.args, page, PAGE_SIZE)
+    reply_async(context=context,
+                chat_id=callback_query.message.chat_id,
+                name='quotes_page',
+                fetch=lambda: pagination.get_page(query, page, PAGE_SIZE),
+                fetch_async=lambda: pagination.get_page_async(query, page, PAGE_SIZE),
+                render=messages.QUOTES,
+                markup=lambda quotes: quotes_page_markup(query, page),
+                message=callback_query.message,
+                disable_web_page_preview=None,
+                then=lambda quotes: pagination.prefetch(query, page, PAGE_SIZE),
+                update=update,
+                dispatcher=dispatcher)
+
+
+def quotes_page_markup(query: pagination.Query, page: int) -> Optional[InlineKeyboardMarkup]:
+    pages = query.pages(PAGE_SIZE)
+    if pages <= 1:
+        return None
 
     buttons = []
     if page > 1:
         buttons.extend([InlineKeyboardButton(text="first",
-                                             callback_data=f'Q1;{pages}'),
+                                             callback_data=pagination.token(query, 1)),
                         InlineKeyboardButton(text="previous",
-                                             callback_data=f'Q{page - 1};{pages}')])
+                                             callback_data=pagination.token(query, page - 1))])
 
     if page < pages:
         buttons.extend([InlineKeyboardButton(text="next",
-                                             callback_data=f'Q{page + 1};{pages}'),
+                                             callback_data=pagination.token(query, page + 1)),
                         InlineKeyboardButton(text="last",
-                                             callback_data=f'Q{pages};{pages}')])
+                                             callback_data=pagination.token(query, pages))])
 
     keyboard = [buttons]
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    edit_async(text=messages.QUOTES(quotes),
-               bot=context.bot,
-               message=query.message,
-               reply_markup=markup)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
 @query_handler
@@ -336,13 +322,34 @@ def stop_handler(update: Update, context: CallbackContext) -> None:
     send_admins_async(text=messages.BOT_STOPPED(update.message.from_user),
                       bot=context.bot)
 
+    if cluster.is_worker():
+        cluster.request_stop()
+        return
+
     def stop():
-        updater.is_idle = False
         updater.stop()
+        updater.is_idle = False
 
     threading.Thread(target=stop).start()
 
 
+@admin_command_handler
+def stats_handler(update: Update, context: CallbackContext) -> None:
+    cache = restapiservice.cache_stats()['total']
+    queue = sendqueue.stats()
+    gauges = {
+        'update_queue': updater.update_queue.qsize(),
+        'send_queue': queue['interactive'] + queue['broadcast'],
+        'offload_pending': offload.stats()['pending'],
+        'response_hit_rate': cache['hit_rate'],
+        'page_hit_rate': pagination.stats()['hit_rate'],
+        'throttled': throttle.stats()['throttled']
+    }
+    send_text_async(bot=context.bot,
+                    chat_id=update.message.chat_id,
+                    text=messages.STATS(metrics.summary(), gauges))
+
+
 @admin_query_handler
 def accept_handler(update: Update, context: CallbackContext) -> None:
     query: CallbackQuery = update.callback_query
@@ -379,21 +386,63 @@ def deny_handler(update: Update, context: CallbackContext) -> None:
                         text=messages.WHITELIST_REQUEST_DENIED)
 
 
+def shutdown() -> None:
+    global shut_down
+    with shutdown_lock:
+        if shut_down:
+            return
+        shut_down = True
+        webhook.stop()
+        notify.flush()
+        sendqueue.stop(timeout=5)
+        storage.close()
+        if aio.running():
+            try:
+                aio.run(restapiservice.close_async(), timeout=5)
+            except futures.TimeoutError:
+                logging.warning("Timed out closing the asynchronous HTTP session.")
+            aio.stop()
+        offload.stop()
+        metrics.stop()
+
+
+def notify_circuit_change(name: str, previous: str, state: str) -> None:
+    if state != breaker.CLOSED and not (previous == breaker.CLOSED and state == breaker.OPEN):
+        return
+    send_admins_async(text=messages.CIRCUIT_CHANGED(name, previous, state),
+                      bot=updater.bot,
+                      key=('circuit', name, state),
+                      summary=messages.CIRCUIT_SUMMARY(name),
+                      detail=messages.CIRCUIT_CHANGED(name, previous, state))
+
+
 def error_handler(update: Update, context: CallbackContext) -> None:
+    if restapiservice.is_backend_failure(context.error):
+        logging.warning(f"Backend failure: {context.error}")
+        return
+
     code = random.randint(1000, 10000)
     logging.error(f"\nError code: {code}")
-    if update.message:
+    if update and update.message:
         command = update.message.text
         user = update.message.from_user
+        name = throttle.command_name(command)
         send_admins_async(text=messages.ERROR_COMMAND(command, user, code),
-                          bot=context.bot)
+                          bot=context.bot,
+                          key=('error', type(context.error).__name__, name),
+                          summary=messages.ERROR_SUMMARY(context.error, f'/{name}'),
+                          detail=messages.ERROR_DETAIL(code, user))
         logging.error(f"Command: {command} by user {messages.USERNAME(user)}")
-    if update.callback_query:
+    if update and update.callback_query:
         query: CallbackQuery = update.callback_query
         data = query.data
         user = query.from_user
+        name = throttle.query_name(data)
         send_admins_async(text=messages.ERROR_QUERY(data, user, code),
-                          bot=context.bot)
+                          bot=context.bot,
+                          key=('error', type(context.error).__name__, name),
+                          summary=messages.ERROR_SUMMARY(context.error, f'{name} query'),
+                          detail=messages.ERROR_DETAIL(code, user))
         logging.error(f"Query: {data} by user {messages.USERNAME(user)}")
 
     logging.exception(context.error)
@@ -406,14 +455,41 @@ def unknown_handler(update: Update, context: CallbackContext) -> None:
                     text=messages.UNKNOWN_COMMAND)
 
 
-if __name__ == '__main__':
-    logging.info("Started bot")
-    with open(token_file) as t_file:
-        token = t_file.readline()
-    updater = Updater(token=token, use_context=True)
-    del token
+def refresh_subscriptions(context: CallbackContext) -> None:
+    subscriptions.refresh(storage.backend.subscriptions())
+
+
+def register_metrics() -> None:
+    metrics.instrument_telegram(updater.bot.request)
+    metrics.collect('updates', lambda: {'queue_depth': updater.update_queue.qsize()})
+    metrics.collect('send_queue', sendqueue.stats)
+    metrics.collect('cache', restapiservice.cache_stats)
+    metrics.collect('pagination', pagination.stats)
+    metrics.collect('offload', offload.stats)
+    metrics.collect('throttle', throttle.stats)
+    metrics.collect('sync', sync.engine.stats)
+    metrics.collect('replies', lambda: dict(reply_stats))
+    metrics.collect('logging', logs.stats)
+    metrics.collect('notify', notify.stats)
+    if metrics.PORT:
+        metrics.serve(port=metrics.PORT + (cluster.worker_index + 1 if cluster.is_worker() else 0))
+
+
+def create_updater(token: str) -> Updater:
+    global updater, dispatcher
+    updater = Updater(token=token, base_url=webhook.BASE_URL, use_context=True, workers=aio.WORKERS)
     dispatcher = updater.dispatcher
+    breaker.listeners.append(notify_circuit_change)
+    register_metrics()
     load_subscriptions()
+    if cluster.WORKERS:
+        updater.job_queue.run_repeating(callback=refresh_subscriptions,
+                                        interval=cluster.REFRESH_INTERVAL,
+                                        first=cluster.REFRESH_INTERVAL)
+    if quotestore.ENABLED:
+        updater.job_queue.run_repeating(callback=sync.sync_job,
+                                        interval=quotestore.SYNC_INTERVAL,
+                                        first=0)
     dispatcher.add_handler(CommandHandler('quotes', quotes_handler))
     dispatcher.add_handler(CommandHandler('quoteoftheday', quote_of_the_day_handler))
     dispatcher.add_handler(CommandHandler('persons', persons_handler))
@@ -424,6 +500,7 @@ if __name__ == '__main__':
     dispatcher.add_handler(CommandHandler('whitelist', whitelist_handler))
     dispatcher.add_handler(CommandHandler('blacklist', blacklist_handler))
     dispatcher.add_handler(CommandHandler('stop', stop_handler))
+    dispatcher.add_handler(CommandHandler('stats', stats_handler))
     dispatcher.add_handler(CallbackQueryHandler(callback=quotes_page_handler,
                                                 pattern=r'^Q'))
     dispatcher.add_handler(CallbackQueryHandler(callback=person_handler,
@@ -434,12 +511,28 @@ if __name__ == '__main__':
                                                 pattern=r'^D'))
     dispatcher.add_error_handler(error_handler)
     dispatcher.add_handler(MessageHandler(Filters.command, unknown_handler))
-    dispatcher.add_handler(MessageHandler(Filters.text, top_secret_text_handler))
-    dispatcher.add_handler(MessageHandler(Filters.sticker, top_secret_sticker_handler))
+    dispatcher.add_handler(MessageHandler(Filters.text,
+                                          metrics.timed(metrics.handler_seconds)(top_secret_text_handler)))
+    dispatcher.add_handler(MessageHandler(Filters.sticker,
+                                          metrics.timed(metrics.handler_seconds)(top_secret_sticker_handler)))
+    return updater
+
+
+if __name__ == '__main__':
+    logs.setup()
+    logging.info("Started bot")
+    if aio.MODE == 'asyncio':
+        aio.start()
+    updater = create_updater(config.read_token())
     try:
-        updater.start_polling()
-        logging.info("Successfully started polling.")
+        if webhook.MODE == 'webhook':
+            webhook.start(updater)
+        else:
+            updater.start_polling()
+            logging.info("Successfully started polling.")
         updater.idle()
         logging.info("Stopped bot gracefully.")
     except Unauthorized as err:
         logging.error("Your token seems to be incorrect, bot was not able to start polling.")
+    finally:
+        shutdown()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List
+
+import config
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+settings = config.section('breaker')
+
+WINDOW = settings.get('window', 20)
+MIN_REQUESTS = settings.get('min_requests', 5)
+FAILURE_RATE = settings.get('failure_rate', 0.5)
+OPEN_SECONDS = settings.get('open_seconds', 30.0)
+
+listeners: List[Callable[[str, str, str], None]] = []
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit for {name} is open.")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(self,
+                 name: str,
+                 window: int = WINDOW,
+                 min_requests: int = MIN_REQUESTS,
+                 failure_rate: float = FAILURE_RATE,
+                 open_seconds: float = OPEN_SECONDS):
+        self.name = name
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.rejected = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        previous, self.state = self.state, state
+        logging.warning(f"Circuit for {self.name} changed from {previous} to {state}.")
+        for listener in listeners:
+            try:
+                listener(self.name, previous, state)
+            except Exception:
+                logging.exception(f"Circuit listener failed for {self.name}.")
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN and (not self._probing or now - self._probe_started >= self.open_seconds):
+                self._probing = True
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._outcomes.append(True)
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._outcomes.clear()
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._outcomes.append(False)
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._opened = time.monotonic()
+                self._transition(OPEN)
+                return
+            failures = self._outcomes.count(False)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_requests \
+                    and failures / len(self._outcomes) >= self.failure_rate:
+                self._opened = time.monotonic()
+                self._transition(OPEN)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'state': self.state,
+            'failures': self._outcomes.count(False),
+            'requests': len(self._outcomes),
+            'rejected': self.rejected
+        }
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get(name: str) -> CircuitBreaker:
+    breaker = breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def stats() -> Dict[str, Dict[str, object]]:
+    return {name: breaker.stats() for name, breaker in breakers.items()}
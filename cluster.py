@@ -0,0 +1,128 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from datetime import date
+from queue import Full
+from typing import Dict, List
+
+from telegram import Bot, Update
+
+import config
+import logs
+import sharedstore
+import storage
+import webhook
+
+settings = config.section('cluster')
+
+WORKERS = settings.get('workers', 0)
+QUEUE_SIZE = settings.get('queue_size', 1000)
+REFRESH_INTERVAL = settings.get('refresh_interval', 30.0)
+SLOT_LEASE = settings.get('slot_lease', 3600.0)
+
+worker_index = None
+
+
+def is_worker() -> bool:
+    return worker_index is not None
+
+
+def claim_slot(slot: str) -> bool:
+    return sharedstore.store.claim(key=f'fanout:{slot}:{date.today().isoformat()}',
+                                   owner=sharedstore.node_id(),
+                                   ttl=SLOT_LEASE)
+
+
+def shard(data: Dict) -> int:
+    for field in ['message', 'edited_message', 'channel_post', 'edited_channel_post']:
+        if field in data:
+            return data[field]['chat']['id']
+    if 'callback_query' in data:
+        query = data['callback_query']
+        return query['message']['chat']['id'] if 'message' in query else query['from']['id']
+    return data.get('update_id', 0)
+
+
+def request_stop() -> None:
+    os.kill(os.getppid(), signal.SIGTERM)
+
+
+def worker(index: int, updates: multiprocessing.Queue, records: multiprocessing.Queue) -> None:
+    global worker_index
+    worker_index = index
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, signal.SIG_IGN)
+    logs.attach(records)
+
+    import aio
+    import bot
+    import sendqueue
+
+    sendqueue.queue.limit_global(sendqueue.GLOBAL_RATE / WORKERS, max(1, sendqueue.GLOBAL_BURST // WORKERS))
+    if aio.MODE == 'asyncio':
+        aio.start()
+    updater = bot.create_updater(config.read_token())
+    webhook.start_dispatcher(updater)
+    logging.info(f"Worker {index} started.")
+    try:
+        while True:
+            data = updates.get()
+            if data is None:
+                break
+            updater.update_queue.put(Update.de_json(data, updater.bot))
+    finally:
+        updater.stop()
+        bot.shutdown()
+        logging.info(f"Worker {index} stopped.")
+
+
+def check_backends() -> None:
+    if WORKERS > 1 and sharedstore.BACKEND == 'local':
+        raise ValueError("The local shared store does not coordinate workers, use cluster.store: file.")
+    if WORKERS > 1 and storage.BACKEND == 'yaml':
+        raise ValueError("The YAML storage backend is not shared safely between workers, use sqlite.")
+
+
+def run(token: str) -> None:
+    check_backends()
+    context = multiprocessing.get_context('spawn')
+    queues: List[multiprocessing.Queue] = [context.Queue(QUEUE_SIZE) for _ in range(WORKERS)]
+    records = context.Queue(logs.QUEUE_SIZE)
+    logs.listen(records)
+    processes = [context.Process(target=worker, args=(index, queue, records), name=f'worker-{index}')
+                 for index, queue in enumerate(queues)]
+    for process in processes:
+        process.start()
+
+    stopped = threading.Event()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, lambda *args: stopped.set())
+
+    webhook.serve(lambda data: queues[shard(data) % WORKERS].put(data), Bot(token, base_url=webhook.BASE_URL))
+    logging.info(f"Dispatching updates to {WORKERS} workers.")
+    while not stopped.wait(1.0):
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                logging.error(f"Worker {index} exited with {process.exitcode}, stopping.")
+                stopped.set()
+
+    webhook.stop()
+    for queue in queues:
+        try:
+            queue.put(None, timeout=1.0)
+        except Full:
+            pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+    logging.info("Stopped all workers.")
+
+
+if __name__ == '__main__':
+    import cluster
+
+    logs.setup()
+    cluster.run(config.read_token())
@@ -0,0 +1,26 @@
+from typing import Any, Dict
+
+import yaml
+
+config_file = 'config.yml'
+token_file = 'token.txt'
+
+
+def read(filename: str) -> Dict[str, Any]:
+    try:
+        with open(filename, encoding='UTF-8') as file:
+            return yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        return {}
+
+
+config = read(config_file)
+
+
+def section(name: str) -> Dict[str, Any]:
+    return config.get(name) or {}
+
+
+def read_token(filename: str = token_file) -> str:
+    with open(filename) as file:
+        return file.readline().strip()
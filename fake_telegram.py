@@ -0,0 +1,193 @@
+import argparse
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Quotesc', 'username': 'quotesc_bot'}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 8081):
+        super().__init__((listen, port), FakeTelegramHandler)
+        self.webhook_url: Optional[str] = None
+        self.secret: Optional[str] = None
+        self.connected = threading.Event()
+        self._updates: List[Dict] = []
+        self._pushed: Dict[int, float] = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self.latencies: List[float] = []
+        self.replies: List[Dict] = []
+
+    @property
+    def mode(self) -> str:
+        return 'webhook' if self.webhook_url else 'polling'
+
+    def start(self) -> 'FakeTelegram':
+        threading.Thread(target=self.serve_forever, name='fake-telegram', daemon=True).start()
+        return self
+
+    def message(self, chat_id: int, **fields: Any) -> Dict:
+        return {'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Chat'},
+                **fields}
+
+    def push(self, text: str, chat_id: int, user_id: int) -> None:
+        command = text.split(' ', 1)[0]
+        message = self.message(chat_id,
+                               text=text,
+                               entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+                               if text.startswith('/') else [])
+        message['from'] = {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'last_name': str(user_id)}
+        update = {'update_id': next(self._update_ids), 'message': message}
+        with self._condition:
+            self._pushed[chat_id] = time.monotonic()
+        if self.webhook_url:
+            request = urllib.request.Request(self.webhook_url,
+                                             data=json.dumps(update).encode(),
+                                             headers={'Content-Type': 'application/json',
+                                                      SECRET_HEADER: self.secret or ''})
+            urllib.request.urlopen(request).close()
+        else:
+            with self._condition:
+                self._updates.append(update)
+                self._condition.notify_all()
+
+    def get_updates(self, offset: int, timeout: float) -> List[Dict]:
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            return list(self._updates)
+
+    def replied(self, method: str, chat_id: Optional[int], data: Dict) -> None:
+        with self._condition:
+            self.replies.append({**data, 'method': method, 'chat_id': chat_id})
+            pushed = self._pushed.pop(chat_id, None)
+            if pushed is not None:
+                self.latencies.append(time.monotonic() - pushed)
+                self._condition.notify_all()
+
+    def wait(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self.latencies) < count and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            return len(self.latencies) >= count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            latencies = list(self.latencies)
+        return {
+            'mode': self.mode,
+            'replies': len(latencies),
+            'pending': len(self._pushed),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies, default=0.0)
+        }
+
+    def call(self, method: str, data: Dict) -> Any:
+        if method == 'getMe':
+            self.connected.set()
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook_url = data.get('url') or None
+            self.secret = data.get('secret_token')
+            self.connected.set()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'getUpdates':
+            self.connected.set()
+            return self.get_updates(int(data.get('offset') or 0), float(data.get('timeout') or 0))
+        if method == 'getChat':
+            return {'id': data.get('chat_id'), 'type': 'private', 'first_name': 'Chat'}
+        if method == 'answerCallbackQuery':
+            return True
+        chat_id = data.get('chat_id')
+        chat_id = int(chat_id) if chat_id is not None else None
+        self.replied(method, chat_id, data)
+        if method == 'sendSticker':
+            return self.message(chat_id, sticker={'file_id': data.get('sticker'), 'width': 512, 'height': 512})
+        return self.message(chat_id, text=data.get('text', ''))
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    server: FakeTelegram
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        method = self.path.rstrip('/').rsplit('/', 1)[-1]
+        response = json.dumps({'ok': True, 'result': self.server.call(method, data)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def load(server: FakeTelegram, updates: int, rate: float, user_id: int, text: str, first_chat_id: int) -> None:
+    interval = 1.0 / rate if rate else 0.0
+    start = time.monotonic()
+    for number in range(updates):
+        delay = start + number * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        server.push(text=text, chat_id=first_chat_id + number, user_id=user_id)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listen', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=100.0)
+    parser.add_argument('--user-id', type=int, default=1000)
+    parser.add_argument('--text', default='/help')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeTelegram(args.listen, args.port).start()
+    logging.info(f"Fake Telegram listening on {args.listen}:{args.port}, waiting for the bot to connect.")
+    fake.connected.wait()
+    time.sleep(1)
+    logging.info(f"Bot connected in {fake.mode} mode, sending {args.updates} updates at {args.rate}/s.")
+    load(fake, args.updates, args.rate, args.user_id, args.text, first_chat_id=args.user_id * 1000)
+    fake.wait(args.updates, args.timeout)
+    stats = fake.stats()
+    print(f"{stats['mode']}: {stats['replies']} replies, {stats['pending']} pending, "
+          f"p50 {stats['p50'] * 1000:.1f}ms, p95 {stats['p95'] * 1000:.1f}ms, "
+          f"p99 {stats['p99'] * 1000:.1f}ms, max {stats['max'] * 1000:.1f}ms")
+    fake.shutdown()
@@ -0,0 +1,113 @@
+import logging
+import threading
+from datetime import time
+from typing import Callable, Dict, Optional, Set
+
+from telegram import Bot
+from telegram.ext import CallbackContext, Job, JobQueue
+
+import config
+
+settings = config.section('fanout')
+
+BATCH_SIZE = settings.get('batch_size', 25)
+BATCH_INTERVAL = settings.get('batch_interval', 1.0)
+
+
+def parse_slot(raw_time: str) -> time:
+    hour, minute = [int(x) for x in raw_time.split(':')]
+    return time(hour=hour, minute=minute)
+
+
+class FanOut:
+    def __init__(self,
+                 render: Callable[[], str],
+                 deliver: Callable[[Bot, int, str], None],
+                 batch_size: int = BATCH_SIZE,
+                 batch_interval: float = BATCH_INTERVAL,
+                 claim: Optional[Callable[[str], bool]] = None):
+        self.render = render
+        self.deliver = deliver
+        self.claim = claim
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._buckets: Dict[str, Set[int]] = {}
+        self._slots: Dict[int, str] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._job_queue: Optional[JobQueue] = None
+        self._lock = threading.Lock()
+
+    def start(self, job_queue: JobQueue) -> None:
+        with self._lock:
+            self._job_queue = job_queue
+            for slot in self._buckets:
+                self._schedule(slot)
+
+    def _schedule(self, slot: str) -> None:
+        if self._job_queue is None or slot in self._jobs:
+            return
+        self._jobs[slot] = self._job_queue.run_daily(callback=self._run_slot,
+                                                     time=parse_slot(slot),
+                                                     context=slot,
+                                                     name=f'fanout {slot}')
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get(self, chat_id: int) -> Optional[str]:
+        return self._slots.get(chat_id)
+
+    def add(self, chat_id: int, raw_time: str) -> Optional[str]:
+        with self._lock:
+            previous = self._slots.get(chat_id)
+            if previous is not None:
+                self._buckets[previous].discard(chat_id)
+            self._slots[chat_id] = raw_time
+            self._buckets.setdefault(raw_time, set()).add(chat_id)
+            self._schedule(raw_time)
+            return previous
+
+    def remove(self, chat_id: int) -> Optional[str]:
+        with self._lock:
+            previous = self._slots.pop(chat_id, None)
+            if previous is not None:
+                self._buckets[previous].discard(chat_id)
+            return previous
+
+    def refresh(self, subscriptions: Dict[int, str]) -> None:
+        with self._lock:
+            slots = dict(self._slots)
+        for chat_id in [chat_id for chat_id in slots if chat_id not in subscriptions]:
+            self.remove(chat_id)
+        for chat_id, raw_time in subscriptions.items():
+            if slots.get(chat_id) != raw_time:
+                self.add(chat_id, raw_time)
+
+    def _run_slot(self, context: CallbackContext) -> None:
+        slot: str = context.job.context
+        with self._lock:
+            chat_ids = list(self._buckets.get(slot, ()))
+        if not chat_ids:
+            return
+        if self.claim is not None and not self.claim(slot):
+            logging.info(f"Quote of the day for {slot} is sent by another worker.")
+            return
+
+        text = self.render()
+        batches = [chat_ids[index:index + self.batch_size] for index in range(0, len(chat_ids), self.batch_size)]
+        logging.info(f"Sending quote of the day for {slot} to {len(chat_ids)} chats in {len(batches)} batches.")
+        for number, batch in enumerate(batches):
+            context.job_queue.run_once(callback=self._send_batch,
+                                       when=number * self.batch_interval,
+                                       context=(text, batch))
+
+    def _send_batch(self, context: CallbackContext) -> None:
+        text, batch = context.job.context
+        for chat_id in batch:
+            try:
+                self.deliver(context.bot, chat_id, text)
+            except Exception:
+                logging.exception(f"Could not send quote of the day to {chat_id}.")
@@ -0,0 +1,101 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import aio
+import config
+
+settings = config.section('http')
+
+POOL_SIZE = settings.get('pool_size', aio.WORKERS)
+CONNECT_TIMEOUT = settings.get('connect_timeout', 3.05)
+READ_TIMEOUT = settings.get('read_timeout', 10.0)
+TIMEOUTS: Dict[str, Tuple[float, float]] = {path: tuple(timeout)
+                                            for path, timeout in settings.get('timeouts', {}).items()}
+RETRIES = settings.get('retries', 2)
+BACKOFF = settings.get('backoff', 0.2)
+RETRY_STATUSES = {502, 503, 504}
+
+
+class PoolMonitor:
+    def __init__(self, size: int):
+        self.size = size
+        self.in_flight = 0
+        self.in_flight_max = 0
+        self.requests = 0
+        self.retries = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.in_flight_max = max(self.in_flight_max, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'pool_size': self.size,
+            'in_flight': self.in_flight,
+            'in_flight_max': self.in_flight_max,
+            'utilization': self.in_flight / self.size,
+            'requests': self.requests,
+            'retries': self.retries,
+            'timeouts': self.timeouts
+        }
+
+
+monitor = PoolMonitor(POOL_SIZE)
+
+
+def create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def timeout(path: str) -> Tuple[float, float]:
+    return TIMEOUTS.get(path, (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0, BACKOFF * 2 ** attempt)
+
+
+def should_retry(attempt: int, status: int = None) -> bool:
+    return attempt < RETRIES and (status is None or status in RETRY_STATUSES)
+
+
+def get(session: requests.Session, url: str, path: str, **kwargs) -> requests.Response:
+    attempt = 0
+    while True:
+        try:
+            with monitor.track():
+                response = session.get(url=url, timeout=timeout(path), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            if isinstance(err, requests.Timeout):
+                monitor.timeouts += 1
+            if not should_retry(attempt):
+                raise
+            logging.warning(f"GET {path} failed with {err.__class__.__name__}, retrying.")
+        else:
+            if not should_retry(attempt, response.status_code):
+                return response
+            logging.warning(f"GET {path} returned {response.status_code}, retrying.")
+        monitor.retries += 1
+        time.sleep(backoff(attempt))
+        attempt += 1
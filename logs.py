@@ -0,0 +1,167 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import config
+
+settings = config.section('logging')
+
+LEVEL = settings.get('level', 'INFO')
+FILE = settings.get('file', 'bot.log')
+ROTATE = settings.get('rotate', 'size')
+MAX_BYTES = settings.get('max_bytes', 10 * 2 ** 20)
+WHEN = settings.get('when', 'midnight')
+BACKUPS = settings.get('backups', 7)
+FORMAT = settings.get('format', 'text')
+CONSOLE = settings.get('console', True)
+QUEUE_SIZE = settings.get('queue_size', 10000)
+SAMPLE_RATE = settings.get('sample_rate', 0.1)
+BLOCK_TIMEOUT = settings.get('block_timeout', 1.0)
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s'
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, records: Any):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+                return
+            try:
+                self.queue.put(record, timeout=BLOCK_TIMEOUT)
+            except queue.Full:
+                self.dropped += 1
+
+
+sampler = SampleFilter(SAMPLE_RATE)
+sent = logging.getLogger('sent')
+sent.addFilter(sampler)
+
+handler: Optional[NonBlockingQueueHandler] = None
+records: Optional[queue.Queue] = None
+outputs: List[logging.Handler] = []
+listeners: List[logging.handlers.QueueListener] = []
+
+
+def create_outputs() -> List[logging.Handler]:
+    formatter = JsonFormatter() if FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = []
+    if FILE:
+        if ROTATE == 'size':
+            handlers.append(logging.handlers.RotatingFileHandler(FILE,
+                                                                 maxBytes=MAX_BYTES,
+                                                                 backupCount=BACKUPS,
+                                                                 encoding='utf-8'))
+        elif ROTATE == 'time':
+            handlers.append(logging.handlers.TimedRotatingFileHandler(FILE,
+                                                                      when=WHEN,
+                                                                      backupCount=BACKUPS,
+                                                                      encoding='utf-8'))
+        else:
+            handlers.append(logging.FileHandler(FILE, encoding='utf-8'))
+    if CONSOLE:
+        handlers.append(logging.StreamHandler())
+    for output in handlers:
+        output.setFormatter(formatter)
+    return handlers
+
+
+def attach(target: Any) -> None:
+    global handler
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    handler = NonBlockingQueueHandler(target)
+    root.addHandler(handler)
+    root.setLevel(LEVEL)
+
+
+def listen(source: Any) -> None:
+    if not outputs:
+        outputs.extend(create_outputs())
+    listener = logging.handlers.QueueListener(source, *outputs, respect_handler_level=True)
+    listener.start()
+    listeners.append(listener)
+
+
+def setup() -> None:
+    global records
+    if handler is not None:
+        return
+    records = queue.Queue(QUEUE_SIZE)
+    attach(records)
+    listen(records)
+    atexit.register(stop)
+
+
+def stop() -> None:
+    global handler
+    if handler is not None and listeners:
+        logging.getLogger().removeHandler(handler)
+        handler = None
+    while listeners:
+        listeners.pop().stop()
+    for output in outputs:
+        output.close()
+    outputs.clear()
+
+
+def stats() -> Dict[str, int]:
+    return {
+        'queued': records.qsize() if records is not None else 0,
+        'dropped': handler.dropped if handler is not None else 0,
+        'sampled_out': sampler.dropped
+    }
@@ -1,7 +1,17 @@
-from typing import List, Dict, Union
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from telegram import User, Chat
 
+import config
+from models import Quote
+
+RENDER_CACHE_SIZE = config.section('messages').get('render_cache_size', 4096)
+
+rendered: 'OrderedDict[int, Tuple[Quote, str]]' = OrderedDict()
+rendered_lock = threading.Lock()
+
 QUOTES_FOUND_TEMPLATE = "{} quotes found."
 PERSONS_FOUND_TEMPLATE = "{} persons found."
 QUOTE_TEMPLATE = "{}\n" \
@@ -24,6 +34,19 @@ USER_WHITELISTED_TEMPLATE = "User {} was whitelisted."
 ALREADY_BLACKLISTED_TEMPLATE = "User {} is already blacklisted."
 ALREADY_WHITELISTED_TEMPLATE = "User {} is already whitelisted."
 BOT_STOPPED_TEMPLATE = "Bot was stopped by {}."
+CIRCUIT_CHANGED_TEMPLATE = "Backend endpoint {} changed from {} to {}."
+ERROR_SUMMARY_TEMPLATE = "{} in {}"
+ERROR_DETAIL_TEMPLATE = "Error code {} for {}"
+NO_PERMISSION_SUMMARY_TEMPLATE = "Unauthorized use of {}"
+CIRCUIT_SUMMARY_TEMPLATE = "Backend endpoint {} changed state"
+ADMIN_DIGEST_TEMPLATE = "{} occurred {} more times in the last {:.0f} seconds."
+ADMIN_SUPPRESSED_TEMPLATE = "{} notifications were suppressed to stay within the rate limit."
+PENDING_REQUESTS_TEMPLATE = "{} whitelist requests are waiting for a decision. " \
+                            "Answer them with /whitelist <user id> or /blacklist <user id>."
+PENDING_REQUEST_TEMPLATE = "{} ({})"
+STATS_SECTION_TEMPLATE = "{}:"
+STATS_LATENCY_TEMPLATE = "{}: {} calls, p50 {:.0f} ms, p95 {:.0f} ms"
+STATS_GAUGE_TEMPLATE = "{}: {}"
 
 
 def format_username(user_chat: Union[User, Chat]):
@@ -47,29 +70,43 @@ def format_persons_found(count: int) -> str:
     return PERSONS_FOUND_TEMPLATE.format(count)
 
 
-def format_quotes(quotes: List[Dict]) -> str:
-    res = ""
-    for quote in quotes:
-        if res != "":
-            res += "\n\n"
-        res += f"{QUOTE(quote)}"
-    return res
+def format_quotes(quotes: List[Quote]) -> str:
+    return "\n\n".join([format_quote(quote) for quote in quotes])
+
+
+def render_quote(quote: Quote) -> str:
+    quoted_persons = ", ".join([person.name for person in quote.persons])
+    date = quote.date.replace('-', '/')
+    return QUOTE_TEMPLATE.format(quote.text, quoted_persons, quote.brain, quote.quoter.name, date)
+
+
+def cached_quote(quote: Quote) -> Optional[str]:
+    with rendered_lock:
+        entry = rendered.get(quote.id)
+        if entry is not None and (entry[0] is quote or entry[0] == quote):
+            rendered.move_to_end(quote.id)
+            return entry[1]
+    return None
 
 
-def format_quote(quote: Dict) -> str:
-    text = quote['quote']
-    quoted_persons = ''
-    for person in quote['quotedPersons']:
-        if quoted_persons != '':
-            quoted_persons += ", "
-        quoted_persons += f"{person['firstName']} {person['lastName']}"
-    brain = int(quote['brain'])
-    quoter = f"{quote['quoter']['firstName']} {quote['quoter']['lastName']}"
-    date = quote['date'].replace('-', '/')
-    return QUOTE_TEMPLATE.format(text, quoted_persons, brain, quoter, date)
+def remember_quote(quote: Quote, text: str) -> None:
+    with rendered_lock:
+        rendered[quote.id] = quote, text
+        while len(rendered) > RENDER_CACHE_SIZE:
+            rendered.popitem(last=False)
 
 
-def format_quote_of_the_day(quote_of_the_day: Dict) -> str:
+def format_quote(quote: Quote) -> str:
+    if quote.id is None:
+        return render_quote(quote)
+    text = cached_quote(quote)
+    if text is None:
+        text = render_quote(quote)
+        remember_quote(quote, text)
+    return text
+
+
+def format_quote_of_the_day(quote_of_the_day: Quote) -> str:
     return QUOTE_OF_THE_DAY_TEMPLATE.format(format_quote(quote_of_the_day))
 
 
@@ -121,6 +158,54 @@ def format_bot_stopped(user: User):
     return BOT_STOPPED_TEMPLATE.format(format_username(user))
 
 
+def format_circuit_changed(name: str, previous: str, state: str) -> str:
+    return CIRCUIT_CHANGED_TEMPLATE.format(name, previous, state)
+
+
+def format_error_summary(error: BaseException, command: str) -> str:
+    return ERROR_SUMMARY_TEMPLATE.format(type(error).__name__, command)
+
+
+def format_error_detail(code: int, user_chat: Union[User, Chat]) -> str:
+    return ERROR_DETAIL_TEMPLATE.format(code, format_username(user_chat))
+
+
+def format_no_permission_summary(command: str) -> str:
+    return NO_PERMISSION_SUMMARY_TEMPLATE.format(command)
+
+
+def format_circuit_summary(name: str) -> str:
+    return CIRCUIT_SUMMARY_TEMPLATE.format(name)
+
+
+def format_admin_digest(summary: str, count: int, window: float, details: List[str]) -> str:
+    return "\n".join([ADMIN_DIGEST_TEMPLATE.format(summary, count, window)] + details)
+
+
+def format_admin_suppressed(count: int) -> str:
+    return ADMIN_SUPPRESSED_TEMPLATE.format(count)
+
+
+def format_pending_requests(users: Dict[int, str], limit: int) -> str:
+    lines = [PENDING_REQUEST_TEMPLATE.format(name, user_id) for user_id, name in list(users.items())[:limit]]
+    return "\n".join([PENDING_REQUESTS_TEMPLATE.format(len(users))] + lines)
+
+
+def format_stats(latencies: Dict[str, Dict[str, Tuple[int, float, float]]], gauges: Dict[str, Any]) -> str:
+    lines = []
+    for section, series in latencies.items():
+        if not series:
+            continue
+        lines.append(STATS_SECTION_TEMPLATE.format(section))
+        lines.extend(STATS_LATENCY_TEMPLATE.format(label or '-', count, p50 * 1000, p95 * 1000)
+                     for label, (count, p50, p95) in series.items())
+    if gauges:
+        lines.append(STATS_SECTION_TEMPLATE.format('gauges'))
+        lines.extend(STATS_GAUGE_TEMPLATE.format(name, f'{value:.2f}' if isinstance(value, float) else value)
+                     for name, value in gauges.items())
+    return "\n".join(lines) or NO_STATS
+
+
 ERROR_OCCURRED = "An error occurred. This problem will be automatically reported to the administrators."
 HELP = \
     """
@@ -144,6 +229,9 @@ PENDING = "Your whitelist request has to be accepted by an administrator before
 USER_NOT_FOUND = "User was not found."
 UNKNOWN_COMMAND = "Unknown Command."
 LOADING = "loading..."
+SEARCH_EXPIRED = "This search has expired. Please run /quotes again."
+THROTTLED = "You are sending requests too quickly. Please wait a moment."
+NO_STATS = "No statistics recorded yet."
 USERNAME = format_username
 QUOTES_FOUND = format_quotes_found
 PERSONS_FOUND = format_persons_found
@@ -162,3 +250,12 @@ USER_WHITELISTED = format_user_whitelisted
 ALREADY_BLACKLISTED = format_already_blacklisted
 ALREADY_WHITELISTED = format_already_whitelisted
 BOT_STOPPED = format_bot_stopped
+CIRCUIT_CHANGED = format_circuit_changed
+STATS = format_stats
+ERROR_SUMMARY = format_error_summary
+ERROR_DETAIL = format_error_detail
+NO_PERMISSION_SUMMARY = format_no_permission_summary
+CIRCUIT_SUMMARY = format_circuit_summary
+ADMIN_DIGEST = format_admin_digest
+ADMIN_SUPPRESSED = format_admin_suppressed
+PENDING_REQUESTS = format_pending_requests
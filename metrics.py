@@ -0,0 +1,219 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import config
+
+settings = config.section('metrics')
+
+ENABLED = settings.get('enabled', True)
+LISTEN = settings.get('listen', '127.0.0.1')
+PORT = settings.get('port', 0)
+PREFIX = settings.get('prefix', 'quotesc')
+BUCKETS = tuple(settings.get('buckets', [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]))
+
+NAME_PATTERN = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def metric_name(*parts: str) -> str:
+    return NAME_PATTERN.sub('_', '_'.join(part for part in parts if part))
+
+
+class Histogram:
+    def __init__(self, name: str, label: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.label = label
+        self.buckets = buckets
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label: str = '') -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [0] * (len(self.buckets) + 1), [0.0]
+            series[0][index] += 1
+            series[1][0] += value
+
+    def series(self) -> Dict[str, Tuple[List[int], float]]:
+        with self._lock:
+            return {label: (list(counts), total[0]) for label, (counts, total) in self._series.items()}
+
+    def quantile(self, counts: List[int], fraction: float) -> float:
+        target = fraction * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target and count:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return 0.0
+
+    def exposition(self) -> Iterator[str]:
+        name = metric_name(PREFIX, self.name)
+        yield f'# TYPE {name} histogram'
+        for label, (counts, total) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{name}_bucket{{{self.label}="{label}",le="{le}"}} {cumulative}'
+            yield f'{name}_sum{{{self.label}="{label}"}} {total}'
+            yield f'{name}_count{{{self.label}="{label}"}} {cumulative}'
+
+
+handler_seconds = Histogram('handler_seconds', 'handler')
+backend_seconds = Histogram('backend_seconds', 'endpoint')
+telegram_seconds = Histogram('telegram_seconds', 'method')
+histograms = [handler_seconds, backend_seconds, telegram_seconds]
+
+collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def collect(name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+    collectors[name] = collector
+
+
+@contextmanager
+def _timer(histogram: Histogram, label: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, label)
+
+
+@contextmanager
+def _disabled_timer():
+    yield
+
+
+def timer(histogram: Histogram, label: str):
+    if not ENABLED:
+        return _disabled_timer()
+    return _timer(histogram, label)
+
+
+def timed(histogram: Histogram, label: str = None) -> Callable[[Callable], Callable]:
+    def decorator(call: Callable) -> Callable:
+        if not ENABLED:
+            return call
+        name = label or call.__name__
+
+        def func(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+
+        func.__name__ = call.__name__
+        return func
+
+    return decorator
+
+
+def instrument_telegram(request: Any) -> None:
+    if not ENABLED:
+        return
+    post = request.post
+
+    def timed_post(url: str, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        if method == 'getUpdates':
+            return post(url, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return post(url, *args, **kwargs)
+        finally:
+            telegram_seconds.observe(time.perf_counter() - start, method)
+
+    request.post = timed_post
+
+
+def flatten(prefix: str, values: Dict[Any, Any], labels: Tuple[Tuple[str, str], ...] = ()) \
+        -> Iterator[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+    for key, value in values.items():
+        key = '_'.join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+        if NAME_PATTERN.search(key) or key[:1].isdigit():
+            name, entry_labels = prefix, labels + (('key', key),)
+        else:
+            name, entry_labels = metric_name(prefix, key), labels
+        if isinstance(value, dict):
+            yield from flatten(name, value, entry_labels)
+        elif isinstance(value, bool):
+            yield name, entry_labels, float(value)
+        elif isinstance(value, (int, float)):
+            yield name, entry_labels, float(value)
+
+
+def gauges() -> Iterator[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+    for name, collector in list(collectors.items()):
+        try:
+            yield from flatten(metric_name(PREFIX, name), collector())
+        except Exception as err:
+            logging.warning(f"Could not collect {name} metrics: {err}")
+
+
+def exposition() -> str:
+    lines: List[str] = []
+    for histogram in histograms:
+        lines.extend(histogram.exposition())
+    for name, labels, value in gauges():
+        rendered = ','.join(f'{key}="{label}"' for key, label in labels)
+        lines.append(f'{name}{{{rendered}}} {value}' if rendered else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary() -> Dict[str, Dict[str, Tuple[int, float, float]]]:
+    result = {}
+    for histogram in histograms:
+        result[histogram.name] = {
+            label: (sum(counts), histogram.quantile(counts, 0.5), histogram.quantile(counts, 0.95))
+            for label, (counts, _) in sorted(histogram.series().items())
+        }
+    return result
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+server: Optional[ThreadingHTTPServer] = None
+
+
+def serve(listen: str = LISTEN, port: int = PORT) -> None:
+    global server
+    if not ENABLED or not port or server is not None:
+        return
+    server = ThreadingHTTPServer((listen, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on {listen}:{port}/metrics.")
+
+
+def stop() -> None:
+    global server
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server = None
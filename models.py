@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+
+PERSON_CACHE_SIZE = config.section('models').get('person_cache_size', 4096)
+
+
+class Person:
+    __slots__ = ('id', 'first_name', 'last_name')
+
+    def __init__(self, id: Optional[int], first_name: str, last_name: str):
+        self.id = id
+        self.first_name = first_name
+        self.last_name = last_name
+
+    @property
+    def name(self) -> str:
+        return f"{self.first_name} {self.last_name}"
+
+    def _fields(self) -> Tuple:
+        return self.id, self.first_name, self.last_name
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Person) and self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
+
+    def __repr__(self) -> str:
+        return f"Person({self.id!r}, {self.name!r})"
+
+
+class Quote:
+    __slots__ = ('id', 'text', 'persons', 'brain', 'quoter', 'date')
+
+    def __init__(self,
+                 id: Optional[int],
+                 text: str,
+                 persons: Tuple[Person, ...],
+                 brain: int,
+                 quoter: Person,
+                 date: str):
+        self.id = id
+        self.text = text
+        self.persons = persons
+        self.brain = brain
+        self.quoter = quoter
+        self.date = date
+
+    def _fields(self) -> Tuple:
+        return self.id, self.text, self.persons, self.brain, self.quoter, self.date
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Quote) and self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
+
+    def __repr__(self) -> str:
+        return f"Quote({self.id!r}, {self.text!r})"
+
+
+class Decoder:
+    def __init__(self, maxsize: int = PERSON_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._persons: 'OrderedDict[int, Person]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def person(self, data: Dict) -> Person:
+        person_id = data.get('id')
+        first_name = data.get('firstName', '')
+        last_name = data.get('lastName', '')
+        if person_id is None:
+            return Person(None, first_name, last_name)
+        with self._lock:
+            person = self._persons.get(person_id)
+            if person is not None and person.first_name == first_name and person.last_name == last_name:
+                self._persons.move_to_end(person_id)
+                return person
+            person = self._persons[person_id] = Person(person_id, first_name, last_name)
+            self._persons.move_to_end(person_id)
+            if len(self._persons) > self.maxsize:
+                self._persons.popitem(last=False)
+            return person
+
+    def persons(self, data: Iterable[Dict]) -> List[Person]:
+        return [self.person(person) for person in data]
+
+    def quote(self, data: Optional[Dict]) -> Optional[Quote]:
+        if not data:
+            return None
+        person = self.person
+        return Quote(data.get('id'),
+                     data.get('quote', ''),
+                     tuple([person(quoted) for quoted in data.get('quotedPersons', ())]),
+                     int(data.get('brain', 0)),
+                     person(data.get('quoter') or {}),
+                     data.get('date', ''))
+
+    def quotes(self, data: Iterable[Dict]) -> List[Quote]:
+        quote = self.quote
+        return [quote(item) for item in data]
+
+    def __len__(self) -> int:
+        return len(self._persons)
+
+
+decoder = Decoder()
+decode_person = decoder.person
+decode_persons = decoder.persons
+decode_quote = decoder.quote
+decode_quotes = decoder.quotes
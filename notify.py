@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Set
+
+from telegram import Bot, ReplyMarkup
+
+import config
+import messages
+import sendqueue
+import storage
+from throttle import SlidingWindow
+
+settings = config.section('notify')
+
+WINDOW = settings.get('window', 60.0)
+ADMIN_LIMIT = settings.get('admin_limit', 20)
+ADMIN_PERIOD = settings.get('admin_period', 60.0)
+ADMIN_TTL = settings.get('admin_ttl', 60.0)
+DIGEST_DETAILS = settings.get('digest_details', 10)
+
+
+class Group:
+    __slots__ = ('bot', 'summary', 'count', 'details', 'timer')
+
+    def __init__(self, bot: Bot, summary: str):
+        self.bot = bot
+        self.summary = summary
+        self.count = 0
+        self.details: List[str] = []
+        self.timer: Optional[threading.Timer] = None
+
+
+class AdminNotifier:
+    def __init__(self,
+                 window: float = WINDOW,
+                 admin_limit: int = ADMIN_LIMIT,
+                 admin_period: float = ADMIN_PERIOD,
+                 admin_ttl: float = ADMIN_TTL):
+        self.window = window
+        self.admin_period = admin_period
+        self.admin_ttl = admin_ttl
+        self._limits = SlidingWindow(admin_limit, admin_period)
+        self._admins: List[int] = []
+        self._loaded = float('-inf')
+        self._groups: Dict[Hashable, Group] = {}
+        self._suppressed = Counter()
+        self._deferred: Set[int] = set()
+        self._requests_timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.grouped = 0
+        self.digests = 0
+        self.suppressed = 0
+        self.deferred = 0
+
+    def administrators(self) -> List[int]:
+        now = time.monotonic()
+        if now - self._loaded >= self.admin_ttl:
+            self._admins = list(storage.administrators)
+            self._loaded = now
+        return self._admins
+
+    def notify(self,
+               bot: Bot,
+               text: str,
+               reply_markup: ReplyMarkup = None,
+               key: Hashable = None,
+               summary: str = None,
+               detail: str = None) -> None:
+        if key is not None and reply_markup is None:
+            with self._lock:
+                group = self._groups.get(key)
+                if group is not None:
+                    group.count += 1
+                    if detail is not None and len(group.details) < DIGEST_DETAILS:
+                        group.details.append(detail)
+                    self.grouped += 1
+                    return
+                group = self._groups[key] = Group(bot, summary or text)
+                group.timer = threading.Timer(self.window, self._flush, (key,))
+                group.timer.daemon = True
+                group.timer.start()
+        self._deliver(bot, text, reply_markup)
+
+    def _deliver(self, bot: Bot, text: str, reply_markup: ReplyMarkup = None) -> None:
+        now = time.monotonic()
+        for chat_id in self.administrators():
+            with self._lock:
+                if self._limits.full(chat_id, now):
+                    if reply_markup is None:
+                        self._suppressed[chat_id] += 1
+                        self.suppressed += 1
+                    else:
+                        self._deferred.add(chat_id)
+                        self.deferred += 1
+                        self._schedule_requests(bot)
+                    continue
+                self._limits.add(chat_id, now)
+                suppressed = self._suppressed.pop(chat_id, 0)
+                self.sent += 1
+            self._send(bot, chat_id, text + (f"\n\n{messages.ADMIN_SUPPRESSED(suppressed)}" if suppressed else ''),
+                       reply_markup)
+
+    def _send(self, bot: Bot, chat_id: int, text: str, reply_markup: ReplyMarkup = None) -> None:
+        sendqueue.submit(call=lambda: bot.sendMessage(chat_id=chat_id,
+                                                      text=text,
+                                                      reply_markup=reply_markup),
+                         chat_id=chat_id)
+
+    def _schedule_requests(self, bot: Bot) -> None:
+        if self._requests_timer is None:
+            self._requests_timer = threading.Timer(self.admin_period, self._flush_requests, (bot,))
+            self._requests_timer.daemon = True
+            self._requests_timer.start()
+
+    def _flush_requests(self, bot: Bot) -> None:
+        with self._lock:
+            self._requests_timer = None
+            deferred = list(self._deferred)
+            self._deferred.clear()
+        if not deferred:
+            return
+        users = storage.requests.users()
+        if not users:
+            return
+        text = messages.PENDING_REQUESTS(users, DIGEST_DETAILS)
+        now = time.monotonic()
+        for chat_id in deferred:
+            with self._lock:
+                if self._limits.full(chat_id, now):
+                    self._deferred.add(chat_id)
+                    self._schedule_requests(bot)
+                    continue
+                self._limits.add(chat_id, now)
+                self.sent += 1
+                self.digests += 1
+            self._send(bot, chat_id, text)
+
+    def _flush(self, key: Hashable) -> None:
+        with self._lock:
+            group = self._groups.pop(key, None)
+        if group is not None and group.count:
+            self.digests += 1
+            self._deliver(group.bot, messages.ADMIN_DIGEST(group.summary, group.count, self.window, group.details))
+
+    def flush(self) -> None:
+        with self._lock:
+            keys = list(self._groups)
+            for key in keys:
+                self._groups[key].timer.cancel()
+            timer = self._requests_timer
+            if timer is not None:
+                timer.cancel()
+        for key in keys:
+            self._flush(key)
+        if timer is not None:
+            self._flush_requests(timer.args[0])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'grouped': self.grouped,
+                'digests': self.digests,
+                'suppressed': self.suppressed,
+                'deferred': self.deferred,
+                'open_groups': len(self._groups),
+                'administrators': len(self._admins)
+            }
+
+
+hub = AdminNotifier()
+notify = hub.notify
+flush = hub.flush
+stats = hub.stats
@@ -0,0 +1,137 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import config
+
+settings = config.section('offload')
+
+WORKERS = settings.get('workers', 0)
+MAX_PENDING = settings.get('max_pending', 32)
+START_METHOD = settings.get('start_method', 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+INDEX_BATCH = settings.get('index_batch', 200)
+YAML_BYTES = settings.get('yaml_bytes', 256 * 1024)
+
+
+def _timed(call: Callable[..., Any], *args: Any) -> Tuple[float, Any]:
+    start = time.process_time()
+    result = call(*args)
+    return time.process_time() - start, result
+
+
+class ProcessOffload:
+    def __init__(self, workers: int = WORKERS, max_pending: int = MAX_PENDING, start_method: str = START_METHOD):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0
+        self.peak_pending = 0
+        self.cpu_seconds = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _run_inline(self, call: Callable[..., Any], *args: Any) -> Future:
+        future = Future()
+        try:
+            future.set_result(call(*args))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def submit(self, call: Callable[..., Any], *args: Any) -> Future:
+        with self._lock:
+            if not self.enabled or self._pending >= self.max_pending:
+                self.inline += 1
+                overflow = True
+            else:
+                overflow = False
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context(self.start_method))
+                self._pending += 1
+                self.submitted += 1
+                self.peak_pending = max(self.peak_pending, self._pending)
+                executor = self._executor
+        if overflow:
+            return self._run_inline(call, *args)
+
+        result = Future()
+        submitted = time.monotonic()
+
+        def done(future: Future) -> None:
+            elapsed = time.monotonic() - submitted
+            with self._lock:
+                self._pending -= 1
+                if future.exception() is not None:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                    self.cpu_seconds += future.result()[0]
+                    self.wait_total += elapsed
+                    self.wait_max = max(self.wait_max, elapsed)
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result()[1])
+
+        try:
+            executor.submit(_timed, call, *args).add_done_callback(done)
+        except BrokenProcessPool as err:
+            logging.warning(f"Process pool is broken, running {call.__name__} inline: {err}")
+            with self._lock:
+                self._pending -= 1
+                self.submitted -= 1
+                self.inline += 1
+                if self._executor is executor:
+                    self._executor = None
+            return self._run_inline(call, *args)
+        return result
+
+    def run(self, call: Callable[..., Any], *args: Any) -> Any:
+        return self.submit(call, *args).result()
+
+    def depth(self) -> int:
+        return self._pending
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'peak_pending': self.peak_pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'inline': self.inline,
+                'cpu_seconds': self.cpu_seconds,
+                'wait_avg': self.wait_total / self.completed if self.completed else 0.0,
+                'wait_max': self.wait_max
+            }
+
+    def stop(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+            logging.info(f"Stopped process pool after {self.completed} tasks.")
+
+
+pool = ProcessOffload()
+submit = pool.submit
+run = pool.run
+stats = pool.stats
+stop = pool.stop
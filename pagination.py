@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import aio
+import cache
+import config
+import quotestore
+import restapiservice
+
+settings = config.section('pagination')
+
+QUERY_CACHE_SIZE = settings.get('query_cache_size', 4096)
+QUERY_TTL = settings.get('query_ttl', 3600.0)
+PREFETCH_DEPTH = settings.get('prefetch_depth', 1)
+PREFETCH_TTL = settings.get('prefetch_ttl', 120.0)
+PREFETCH_CACHE_SIZE = settings.get('prefetch_cache_size', 1024)
+PREFETCH_WORKERS = settings.get('prefetch_workers', 2)
+
+queries = cache.TtlCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_TTL)
+prefetched = cache.TtlCache(maxsize=PREFETCH_CACHE_SIZE, ttl=PREFETCH_TTL)
+prefetcher = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+prefetches = 0
+generation = 0
+lock = threading.Lock()
+
+
+class Query:
+    def __init__(self, fingerprint: str, filters: List[str], count: int, ids: Optional[List[int]] = None):
+        self.fingerprint = fingerprint
+        self.filters = filters
+        self.count = count
+        self.ids = ids
+
+    def pages(self, page_size: int) -> int:
+        return (self.count + page_size - 1) // page_size
+
+
+def fingerprint(filters: Optional[List[str]]) -> str:
+    normalized = '\0'.join(quotestore.filter_terms(filters))
+    return hashlib.blake2b(normalized.encode('UTF-8'), digest_size=6).hexdigest()
+
+
+def token(query: Query, page: int) -> str:
+    return f'Q{query.fingerprint};{page}'
+
+
+def parse(data: str) -> Tuple[str, int]:
+    query_fingerprint, page = data[1:].split(';')
+    return query_fingerprint, int(page)
+
+
+def remember(filters: Optional[List[str]], count: int, ids: Optional[List[int]]) -> Query:
+    query = Query(fingerprint=fingerprint(filters),
+                  filters=list(filters or []),
+                  count=count,
+                  ids=ids)
+    queries.put(query.fingerprint, query)
+    return query
+
+
+def find(query_fingerprint: str) -> Optional[Query]:
+    query = queries.get(query_fingerprint)
+    if query is cache.MISSING:
+        return None
+    return query
+
+
+def open_query(filters: Optional[List[str]]) -> Query:
+    if quotestore.store.ready:
+        ids = quotestore.store.search(filters)
+        return remember(filters, len(ids), ids)
+    return remember(filters, restapiservice.get_quotes_count(filters), None)
+
+
+async def open_query_async(filters: Optional[List[str]]) -> Query:
+    if quotestore.store.ready:
+        return open_query(filters)
+    return remember(filters, await restapiservice.get_quotes_count_async(filters), None)
+
+
+def page_key(query: Query, page: int, page_size: int) -> Hashable:
+    return query.fingerprint, page, page_size
+
+
+def store_page(key: Hashable, quotes: List[Dict], loaded_generation: int) -> None:
+    with lock:
+        if loaded_generation == generation:
+            prefetched.put(key, quotes)
+
+
+def load_page(query: Query, page: int, page_size: int) -> List[Dict]:
+    loaded_generation = generation
+    quotes = restapiservice.get_quotes(query.filters, page, page_size)
+    store_page(page_key(query, page, page_size), quotes, loaded_generation)
+    return quotes
+
+
+async def load_page_async(query: Query, page: int, page_size: int) -> List[Dict]:
+    loaded_generation = generation
+    quotes = await restapiservice.get_quotes_async(query.filters, page, page_size)
+    store_page(page_key(query, page, page_size), quotes, loaded_generation)
+    return quotes
+
+
+def invalidate(paths: Tuple[str, ...]) -> None:
+    global generation
+    if restapiservice.QUOTES_PATH not in paths:
+        return
+    with lock:
+        generation += 1
+        removed = prefetched.invalidate()
+    logging.info(f"Invalidated {removed} prefetched pages.")
+
+
+restapiservice.invalidation_listeners.append(invalidate)
+
+
+def get_page(query: Query, page: int, page_size: int) -> List[Dict]:
+    if query.ids is not None:
+        start = (page - 1) * page_size
+        return quotestore.store.get(query.ids[start:start + page_size])
+    quotes = prefetched.get(page_key(query, page, page_size))
+    if quotes is cache.MISSING:
+        quotes = load_page(query, page, page_size)
+    return quotes
+
+
+async def get_page_async(query: Query, page: int, page_size: int) -> List[Dict]:
+    if query.ids is not None:
+        return get_page(query, page, page_size)
+    quotes = prefetched.get(page_key(query, page, page_size))
+    if quotes is cache.MISSING:
+        quotes = await load_page_async(query, page, page_size)
+    return quotes
+
+
+def adjacent_pages(query: Query, page: int, page_size: int) -> Set[int]:
+    pages = query.pages(page_size)
+    candidates = set(range(page - PREFETCH_DEPTH, page + PREFETCH_DEPTH + 1))
+    if page < pages:
+        candidates.add(pages)
+    candidates.discard(page)
+    return {candidate for candidate in candidates if 1 <= candidate <= pages}
+
+
+def _warm(query: Query, page: int, page_size: int) -> None:
+    try:
+        load_page(query, page, page_size)
+    except Exception as err:
+        logging.info(f"Could not prefetch page {page} of {query.fingerprint}: {err}")
+
+
+async def _warm_async(query: Query, page: int, page_size: int) -> None:
+    try:
+        await load_page_async(query, page, page_size)
+    except Exception as err:
+        logging.info(f"Could not prefetch page {page} of {query.fingerprint}: {err}")
+
+
+def prefetch(query: Query, page: int, page_size: int) -> None:
+    global prefetches
+    if query.ids is not None:
+        return
+    for candidate in adjacent_pages(query, page, page_size):
+        if page_key(query, candidate, page_size) in prefetched:
+            continue
+        with lock:
+            prefetches += 1
+        if aio.running():
+            aio.submit(_warm_async(query, candidate, page_size))
+        else:
+            prefetcher.submit(_warm, query, candidate, page_size)
+
+
+def stats() -> Dict[str, float]:
+    page_stats = prefetched.stats()
+    lookups = page_stats['hits'] + page_stats['misses']
+    return {
+        'queries': len(queries),
+        'prefetches': prefetches,
+        'page_hits': page_stats['hits'],
+        'page_misses': page_stats['misses'],
+        'hit_rate': page_stats['hits'] / lookups if lookups else 0.0
+    }
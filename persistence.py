@@ -0,0 +1,89 @@
+import atexit
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Set
+
+import yaml
+
+import config
+
+settings = config.section('persistence')
+
+FLUSH_INTERVAL = settings.get('flush_interval', 5.0)
+FLUSH_THRESHOLD = settings.get('flush_threshold', 100)
+
+
+def dump_atomic(filename: str, data: Any) -> None:
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(prefix=f'.{os.path.basename(filename)}.', dir=directory)
+    try:
+        with os.fdopen(fd, mode='w', encoding='UTF-8') as file:
+            yaml.safe_dump(data, file, allow_unicode=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_name, filename)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+class WriteBehind:
+    def __init__(self, interval: float = FLUSH_INTERVAL, threshold: int = FLUSH_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._dirty: Set = set()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def schedule(self, target) -> None:
+        with self._lock:
+            self._dirty.add(target)
+            self._pending += 1
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            if self._pending >= self.threshold:
+                self._wakeup.set()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                pending, self._pending = self._pending, 0
+            for target in dirty:
+                try:
+                    target.flush()
+                except Exception:
+                    logging.exception(f"Could not flush {target}, retrying later.")
+                    with self._lock:
+                        self._dirty.add(target)
+            if dirty:
+                logging.info(f"Flushed {pending} mutations to {len(dirty)} files.")
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+writer = WriteBehind()
+flush = writer.flush
+stop = writer.stop
+
+atexit.register(writer.stop)
@@ -0,0 +1,172 @@
+import logging
+import random
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+import offload
+from models import Person, Quote
+
+settings = config.section('quotestore')
+
+ENABLED = settings.get('enabled', False)
+SYNC_INTERVAL = settings.get('sync_interval', 60.0)
+FULL_SYNC_INTERVAL = settings.get('full_sync_interval', 3600.0)
+SYNC_PAGE_SIZE = settings.get('sync_page_size', 500)
+SEARCH_CACHE_SIZE = settings.get('search_cache_size', 256)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> Set[str]:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def quote_tokens(quote: Quote) -> Set[str]:
+    tokens = tokenize(quote.text)
+    for person in quote.persons:
+        tokens |= tokenize(person.name)
+    tokens |= tokenize(quote.quoter.name)
+    return tokens
+
+
+def index_tokens(quotes: List[Quote]) -> List[Set[str]]:
+    return [quote_tokens(quote) for quote in quotes]
+
+
+def filter_terms(filters: Optional[List[str]]) -> Tuple[str, ...]:
+    terms: Set[str] = set()
+    for argument in filters or []:
+        terms |= tokenize(argument)
+    return tuple(sorted(terms))
+
+
+class QuoteStore:
+    def __init__(self, search_cache_size: int = SEARCH_CACHE_SIZE):
+        self.ready = False
+        self.search_cache_size = search_cache_size
+        self._quotes: Dict[int, Quote] = {}
+        self._persons: Dict[int, Person] = {}
+        self._tokens: Dict[int, Set[str]] = {}
+        self._index: Dict[str, Set[int]] = {}
+        self._ids: List[int] = []
+        self._searches: 'OrderedDict[Tuple[str, ...], List[int]]' = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._quotes)
+
+    def _unindex(self, quote_id: int) -> None:
+        for token in self._tokens.pop(quote_id, ()):
+            ids = self._index.get(token)
+            if ids is not None:
+                ids.discard(quote_id)
+                if not ids:
+                    del self._index[token]
+
+    def apply(self, quotes: Iterable[Quote]) -> int:
+        quotes = list(quotes)
+        if offload.pool.enabled and len(quotes) >= offload.INDEX_BATCH:
+            token_sets = offload.run(index_tokens, quotes)
+        else:
+            token_sets = index_tokens(quotes)
+        applied = 0
+        with self._lock:
+            for quote, tokens in zip(quotes, token_sets):
+                quote_id = quote.id
+                self._unindex(quote_id)
+                for token in tokens:
+                    self._index.setdefault(token, set()).add(quote_id)
+                self._tokens[quote_id] = tokens
+                self._quotes[quote_id] = quote
+                applied += 1
+            if applied:
+                self._ids = sorted(self._quotes)
+                self._searches.clear()
+        return applied
+
+    def discard(self, quote_ids: Iterable[int]) -> None:
+        with self._lock:
+            for quote_id in quote_ids:
+                self._unindex(quote_id)
+                self._quotes.pop(quote_id, None)
+            self._ids = sorted(self._quotes)
+            self._searches.clear()
+
+    def sync(self, pages: Iterable[List[Quote]]) -> int:
+        seen: Set[int] = set()
+        for quotes in pages:
+            self.apply(quotes)
+            seen.update(quote.id for quote in quotes)
+        with self._lock:
+            removed = set(self._quotes) - seen
+        if removed:
+            self.discard(removed)
+        logging.info(f"Synchronized {len(seen)} quotes, removed {len(removed)}.")
+        return len(seen)
+
+    def watermark(self) -> int:
+        return self._ids[-1] if self._ids else 0
+
+    def apply_persons(self, persons: Iterable[Person]) -> int:
+        applied = 0
+        with self._lock:
+            for person in persons:
+                self._persons[person.id] = person
+                applied += 1
+        return applied
+
+    def sync_persons(self, persons: List[Person]) -> int:
+        with self._lock:
+            self._persons = {person.id: person for person in persons}
+        return len(persons)
+
+    def person_watermark(self) -> int:
+        return max(self._persons, default=0)
+
+    def persons(self, filters: Optional[List[str]] = None) -> List[Person]:
+        terms = set(filter_terms(filters))
+        with self._lock:
+            persons = [self._persons[person_id] for person_id in sorted(self._persons)]
+        if not terms:
+            return persons
+        return [person for person in persons if terms <= tokenize(person.name)]
+
+    def search(self, filters: Optional[List[str]] = None) -> List[int]:
+        terms = filter_terms(filters)
+        with self._lock:
+            if not terms:
+                return self._ids
+            ids = self._searches.get(terms)
+            if ids is not None:
+                self._searches.move_to_end(terms)
+                return ids
+            candidates = sorted((self._index.get(term, set()) for term in terms), key=len)
+            matches = set.intersection(*candidates) if candidates[0] else set()
+            ids = sorted(matches)
+            self._searches[terms] = ids
+            while len(self._searches) > self.search_cache_size:
+                self._searches.popitem(last=False)
+            return ids
+
+    def get(self, quote_ids: Iterable[int]) -> List[Quote]:
+        return [self._quotes[quote_id] for quote_id in quote_ids if quote_id in self._quotes]
+
+    def count(self, filters: Optional[List[str]] = None) -> int:
+        return len(self.search(filters))
+
+    def page(self, filters: Optional[List[str]] = None, page: int = 1, count: int = 0) -> List[Quote]:
+        ids = self.search(filters)
+        start = (page - 1) * count
+        return self.get(ids[start:start + count])
+
+    def random(self, filters: Optional[List[str]] = None) -> Optional[Quote]:
+        ids = self.search(filters)
+        if not ids:
+            return None
+        return self._quotes.get(random.choice(ids))
+
+
+store = QuoteStore()
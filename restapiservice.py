@@ -1,11 +1,27 @@
+import asyncio
 import json
 import logging
-import time
-from typing import List, Dict
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 
 import requests
 
-session = requests.Session()
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import breaker
+import cache
+import config
+import httpclient
+import metrics
+import models
+import quotestore
+import sharedstore
+import singleflight
+
+session = httpclient.create_session()
 
 ACCEPT_APPLICATION_JSON = {'Accept': 'application/json'}
 CONTENT_TYPE_APPLICATION_JSON = {'Content-Type': 'application/json'}
@@ -16,84 +32,287 @@ QUOTES_RANDOM_PATH = '/random'
 QUOTE_OF_THE_DAY_PATH = '/quoteoftheday'
 PERSONS_PATH = '/persons'
 
+settings = config.section('cache')
 
-def timed(call):
-    def func(*args, **kwargs):
-        start = time.time()
-        result = call(*args, **kwargs)
-        end = time.time()
+CACHE_SIZE = settings.get('size', 1024)
+FALLBACK_SIZE = settings.get('fallback_size', 32)
+CACHE_SHARED = settings.get('shared', False)
+CACHE_TTLS: Dict[str, float] = {
+    QUOTES_PATH: 60.0,
+    QUOTES_COUNT_PATH: 60.0,
+    QUOTE_OF_THE_DAY_PATH: 300.0,
+    PERSONS_PATH: 3600.0,
+    **settings.get('ttls', {})
+}
 
-        logging.info(f"{call.__name__} took {(end - start):.2f} seconds.")
+DECODERS: Dict[str, Callable[[Any], Any]] = {
+    QUOTES_PATH: models.decode_quotes,
+    QUOTES_RANDOM_PATH: models.decode_quote,
+    QUOTE_OF_THE_DAY_PATH: models.decode_quote,
+    PERSONS_PATH: models.decode_persons
+}
 
-        return result
+if CACHE_SHARED:
+    response_cache = sharedstore.SharedCache(sharedstore.store, 'responses')
+else:
+    response_cache = cache.TtlCache(maxsize=CACHE_SIZE)
+fallback_cache = cache.TtlCache(maxsize=FALLBACK_SIZE)
+cache_hits = Counter()
+cache_misses = Counter()
+stale_served = Counter()
+flights = singleflight.SingleFlight()
+invalidation_listeners: List[Callable[[Tuple[str, ...]], None]] = []
 
-    return func
+ASYNC_POOL_SIZE = config.section('execution').get('pool_size', 100)
 
+async_session = None
 
-@timed
-def get_quotes_count(filters: List[str] = None) -> int:
-    response = session.get(url=BASE_URL + QUOTES_COUNT_PATH,
-                           headers=ACCEPT_APPLICATION_JSON)
+
+def cache_key(path: str, params: Dict = None, filters: List[str] = None) -> Tuple[Hashable, ...]:
+    return path, tuple(sorted((params or {}).items())), tuple(filters or ())
+
+
+def decode(path: str, data: Any) -> Any:
+    decoder = DECODERS.get(path)
+    return decoder(data) if decoder is not None else data
+
+
+def fetch_json(path: str, params: Dict = None) -> Any:
+    with metrics.timer(metrics.backend_seconds, path):
+        response = httpclient.get(session=session,
+                                  url=BASE_URL + path,
+                                  path=path,
+                                  headers=ACCEPT_APPLICATION_JSON,
+                                  params=params)
     if response.ok:
-        count = response.json()
-        return count['count']
+        return decode(path, json.loads(response.content))
     else:
         response.raise_for_status()
 
 
-@timed
-def get_quotes(filters: List[str] = None, page: int = 1, count: int = 0) -> List[Dict]:
+def is_backend_failure(err: Exception) -> bool:
+    if isinstance(err, (breaker.CircuitOpenError, requests.ConnectionError, requests.Timeout)):
+        return True
+    if aiohttp is not None and isinstance(err, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    status = getattr(getattr(err, 'response', None), 'status_code', None) or getattr(err, 'status', None)
+    return status is not None and status >= 500
+
+
+def serve_stale(path: str, key: Hashable, err: Exception) -> Any:
+    data = response_cache.get_stale(key)
+    if data is cache.MISSING:
+        data = fallback_cache.get_stale(key)
+    if data is cache.MISSING:
+        raise err
+    stale_served[path] += 1
+    logging.info(f"Serving stale response for {path}: {err}")
+    return data
+
+
+def fetched(path: str, key: Hashable, data: Any) -> Any:
+    breaker.get(path).record_success()
+    ttl = CACHE_TTLS.get(path)
+    if ttl:
+        response_cache.put(key, data, ttl)
+    else:
+        fallback_cache.put(key, data, 0.0)
+    return data
+
+
+def failed(path: str, key: Hashable, err: Exception) -> Any:
+    if not is_backend_failure(err):
+        breaker.get(path).record_success()
+        raise err
+    breaker.get(path).record_failure()
+    return serve_stale(path, key, err)
+
+
+def lookup(path: str, key: Hashable) -> Any:
+    if CACHE_TTLS.get(path):
+        data = response_cache.get(key)
+        if data is not cache.MISSING:
+            cache_hits[path] += 1
+            return data
+        cache_misses[path] += 1
+    if not breaker.get(path).allow():
+        return serve_stale(path, key, breaker.CircuitOpenError(path))
+    return cache.MISSING
+
+
+def get_json(path: str, params: Dict = None, filters: List[str] = None) -> Any:
+    key = cache_key(path, params, filters)
+    data = lookup(path, key)
+    if data is not cache.MISSING:
+        return data
+
+    def fetch() -> Any:
+        try:
+            result = fetch_json(path, params)
+        except Exception as err:
+            return failed(path, key, err)
+        return fetched(path, key, result)
+
+    if not CACHE_TTLS.get(path):
+        return fetch()
+    return flights.do(key, fetch)
+
+
+async def fetch_json_async(path: str, params: Dict = None) -> Any:
+    global async_session
+    if aiohttp is None:
+        return await asyncio.get_event_loop().run_in_executor(None, fetch_json, path, params)
+    if async_session is None:
+        async_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE))
+    connect_timeout, read_timeout = httpclient.timeout(path)
+    client_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    with metrics.timer(metrics.backend_seconds, path):
+        attempt = 0
+        while True:
+            try:
+                with httpclient.monitor.track():
+                    async with async_session.get(url=BASE_URL + path,
+                                                 headers=ACCEPT_APPLICATION_JSON,
+                                                 params={key: str(value) for key, value in (params or {}).items()},
+                                                 timeout=client_timeout) as response:
+                        if not httpclient.should_retry(attempt, response.status):
+                            response.raise_for_status()
+                            return decode(path, json.loads(await response.read()))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not httpclient.should_retry(attempt):
+                    raise
+            httpclient.monitor.retries += 1
+            await asyncio.sleep(httpclient.backoff(attempt))
+            attempt += 1
+
+
+async def get_json_async(path: str, params: Dict = None, filters: List[str] = None) -> Any:
+    key = cache_key(path, params, filters)
+    data = lookup(path, key)
+    if data is not cache.MISSING:
+        return data
+
+    async def fetch() -> Any:
+        try:
+            result = await fetch_json_async(path, params)
+        except Exception as err:
+            return failed(path, key, err)
+        return fetched(path, key, result)
+
+    if not CACHE_TTLS.get(path):
+        return await fetch()
+    return await flights.do_async(key, fetch)
+
+
+async def close_async() -> None:
+    global async_session
+    if async_session is not None:
+        await async_session.close()
+        async_session = None
+
+
+def invalidate(*paths: str) -> None:
+    removed = response_cache.invalidate(lambda key: key[0] in paths)
+    fallback_cache.invalidate(lambda key: key[0] in paths)
+    logging.info(f"Invalidated {removed} cached responses for {', '.join(paths)}.")
+    for listener in invalidation_listeners:
+        listener(paths)
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {
+        'total': response_cache.stats(),
+        'hits': dict(cache_hits),
+        'misses': dict(cache_misses),
+        'stale': dict(stale_served),
+        'breakers': breaker.stats(),
+        'single_flight': flights.stats(),
+        'http': httpclient.monitor.stats()
+    }
+
+
+def get_quotes_count(filters: List[str] = None) -> int:
+    if quotestore.store.ready:
+        return quotestore.store.count(filters)
+    count = get_json(path=QUOTES_COUNT_PATH,
+                     filters=filters)
+    return count['count']
+
+
+def get_quotes(filters: List[str] = None, page: int = 1, count: int = 0) -> List[models.Quote]:
+    if quotestore.store.ready:
+        return quotestore.store.page(filters, page, count)
     params = {
         '_page': page,
         '_limit': count
     }
-    response = session.get(url=BASE_URL + QUOTES_PATH,
-                           headers=ACCEPT_APPLICATION_JSON,
-                           params=params)
-    if response.ok:
-        quotes = response.json()
-        return quotes
-    else:
-        response.raise_for_status()
+    return get_json(path=QUOTES_PATH,
+                    params=params,
+                    filters=filters)
 
 
-@timed
-def get_quote_random(filters: List[str] = None) -> Dict:
-    response = session.get(url=BASE_URL + QUOTES_RANDOM_PATH,
-                           headers=ACCEPT_APPLICATION_JSON)
-    if response.ok:
-        quote = response.json()
-        return quote
-    else:
-        response.raise_for_status()
+def get_quote_random(filters: List[str] = None) -> Optional[models.Quote]:
+    if quotestore.store.ready:
+        return quotestore.store.random(filters)
+    return get_json(path=QUOTES_RANDOM_PATH,
+                    filters=filters)
 
 
-@timed
-def get_quote_of_the_day() -> Dict:
-    response = session.get(url=BASE_URL + QUOTE_OF_THE_DAY_PATH,
-                           headers=ACCEPT_APPLICATION_JSON)
-    if response.ok:
-        quote = response.json()
-        return quote
-    else:
-        response.raise_for_status()
+def get_quote_of_the_day() -> Optional[models.Quote]:
+    return get_json(path=QUOTE_OF_THE_DAY_PATH)
 
 
-@timed
-def get_persons(filters: List[str] = None) -> List[Dict]:
-    response = session.get(url=BASE_URL + PERSONS_PATH,
-                           headers=ACCEPT_APPLICATION_JSON)
-    if response.ok:
-        persons = response.json()
-        return persons
-    else:
-        response.raise_for_status()
+def get_persons(filters: List[str] = None) -> List[models.Person]:
+    if quotestore.store.ready:
+        return quotestore.store.persons(filters)
+    return get_json(path=PERSONS_PATH,
+                    filters=filters)
+
+
+async def get_quotes_count_async(filters: List[str] = None) -> int:
+    if quotestore.store.ready:
+        return quotestore.store.count(filters)
+    count = await get_json_async(path=QUOTES_COUNT_PATH,
+                                 filters=filters)
+    return count['count']
+
+
+async def get_quotes_async(filters: List[str] = None, page: int = 1, count: int = 0) -> List[models.Quote]:
+    if quotestore.store.ready:
+        return quotestore.store.page(filters, page, count)
+    params = {
+        '_page': page,
+        '_limit': count
+    }
+    return await get_json_async(path=QUOTES_PATH,
+                                params=params,
+                                filters=filters)
+
+
+async def get_quote_random_async(filters: List[str] = None) -> Optional[models.Quote]:
+    if quotestore.store.ready:
+        return quotestore.store.random(filters)
+    return await get_json_async(path=QUOTES_RANDOM_PATH,
+                                filters=filters)
+
+
+async def get_quote_of_the_day_async() -> Optional[models.Quote]:
+    return await get_json_async(path=QUOTE_OF_THE_DAY_PATH)
+
+
+async def get_persons_async(filters: List[str] = None) -> List[models.Person]:
+    if quotestore.store.ready:
+        return quotestore.store.persons(filters)
+    return await get_json_async(path=PERSONS_PATH,
+                                filters=filters)
 
 
-@timed
 def post_quote(quote: Dict) -> None:
-    response = session.post(url=BASE_URL + QUOTES_PATH,
-                            data=json.dumps(quote),
-                            headers=CONTENT_TYPE_APPLICATION_JSON)
+    with metrics.timer(metrics.backend_seconds, f'POST {QUOTES_PATH}'):
+        response = session.post(url=BASE_URL + QUOTES_PATH,
+                                data=json.dumps(quote),
+                                headers=CONTENT_TYPE_APPLICATION_JSON,
+                                timeout=httpclient.timeout(QUOTES_PATH))
     if not response.ok:
         response.raise_for_status()
+    invalidate(QUOTES_PATH, QUOTES_COUNT_PATH)
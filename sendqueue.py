@@ -0,0 +1,296 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from telegram.error import RetryAfter
+
+import config
+
+INTERACTIVE = 0
+BROADCAST = 1
+PRIORITIES = [INTERACTIVE, BROADCAST]
+
+settings = config.section('sendqueue')
+
+GLOBAL_RATE = settings.get('global_rate', 30.0)
+GLOBAL_BURST = settings.get('global_burst', 30)
+CHAT_RATE = settings.get('chat_rate', 1.0)
+CHAT_BURST = settings.get('chat_burst', 3)
+WORKERS = settings.get('workers', 8)
+MAX_RETRIES = settings.get('max_retries', 3)
+PRUNE_INTERVAL = 60.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.ready = 0.0
+
+    def _fill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        self._fill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def ready_at(self, now: float) -> float:
+        self.ready = max(self.ready, now + self.delay(now))
+        return self.ready
+
+    def take(self, now: float) -> None:
+        self._fill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._fill(now)
+        return self.tokens >= self.capacity
+
+
+class _Item:
+    def __init__(self, call: Callable[[], Any], chat_id: Union[int, str], priority: int, sequence: int):
+        self.call = call
+        self.chat_id = chat_id
+        self.priority = priority
+        self.sequence = sequence
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class SendQueue:
+    def __init__(self,
+                 global_rate: float = GLOBAL_RATE,
+                 global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST,
+                 workers: int = WORKERS):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._lanes: Dict[int, Deque[_Item]] = {priority: deque() for priority in PRIORITIES}
+        self._delayed: List[Tuple[float, int, _Item]] = []
+        self._busy: Set[Union[int, str]] = set()
+        self._parked: Dict[Union[int, str], Deque[_Item]] = {}
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._pruned = time.monotonic()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='send')
+        self._thread: Optional[threading.Thread] = None
+        self._in_flight = 0
+        self._stopped = False
+        self._aborted = False
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def submit(self,
+               call: Callable[[], Any],
+               chat_id: Union[int, str],
+               priority: int = INTERACTIVE,
+               delay: float = 0.0) -> Future:
+        with self._condition:
+            item = _Item(call=call, chat_id=chat_id, priority=priority, sequence=next(self._sequence))
+            if self._stopped:
+                item.future.set_exception(RuntimeError("The send queue is stopped."))
+                return item.future
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='send-queue', daemon=True)
+                self._thread.start()
+            if delay > 0:
+                heapq.heappush(self._delayed, (item.enqueued + delay, item.sequence, item))
+            else:
+                self._lanes[priority].append(item)
+            self._condition.notify()
+        return item.future
+
+    def limit_global(self, rate: float, burst: float) -> None:
+        with self._condition:
+            self._global = TokenBucket(rate, burst)
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next(self, now: float) -> Tuple[Optional[_Item], float]:
+        ready: List[_Item] = []
+        while self._delayed and self._delayed[0][0] <= now:
+            ready.append(heapq.heappop(self._delayed)[2])
+        for item in reversed(ready):
+            self._lanes[item.priority].appendleft(item)
+
+        if now < self._paused_until:
+            return None, self._paused_until - now
+
+        for priority in PRIORITIES:
+            lane = self._lanes[priority]
+            while lane:
+                item = lane[0]
+                if item.future.cancelled():
+                    lane.popleft()
+                    continue
+                if item.chat_id in self._busy:
+                    lane.popleft()
+                    self._parked.setdefault(item.chat_id, deque()).append(item)
+                    continue
+                ready = self._chat_bucket(item.chat_id).ready_at(now)
+                if ready > now:
+                    lane.popleft()
+                    heapq.heappush(self._delayed, (ready, item.sequence, item))
+                    continue
+                wait = self._global.delay(now)
+                if wait > 0:
+                    return None, wait
+                lane.popleft()
+                return item, 0.0
+
+        if self._delayed:
+            return None, self._delayed[0][0] - now
+        return None, None
+
+    def _prune(self, now: float) -> None:
+        if now - self._pruned < PRUNE_INTERVAL:
+            return
+        self._pruned = now
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.is_full(now)]:
+            del self._chats[chat_id]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if self._aborted:
+                    self._fail_pending()
+                    return
+                now = time.monotonic()
+                item, wait = self._next(now)
+                if item is None:
+                    if self._stopped and not self._in_flight and not self._delayed \
+                            and not any(self._lanes.values()):
+                        return
+                    self._condition.wait(timeout=wait)
+                    continue
+                self._global.take(now)
+                self._chat_bucket(item.chat_id).take(now)
+                self._prune(now)
+                self._in_flight += 1
+                self._busy.add(item.chat_id)
+            self._executor.submit(self._deliver, item)
+
+    def _release(self, item: _Item) -> None:
+        self._in_flight -= 1
+        self._busy.discard(item.chat_id)
+        for parked in reversed(self._parked.pop(item.chat_id, ())):
+            self._lanes[parked.priority].appendleft(parked)
+        self._condition.notify()
+
+    def _deliver(self, item: _Item) -> None:
+        item.attempts += 1
+        if item.attempts == 1 and not item.future.set_running_or_notify_cancel():
+            with self._condition:
+                self._release(item)
+            return
+        try:
+            result = item.call()
+        except RetryAfter as err:
+            with self._condition:
+                self._release(item)
+                self.rate_limited += 1
+                if item.attempts <= MAX_RETRIES and not self._aborted:
+                    self.retries += 1
+                    ready = time.monotonic() + err.retry_after
+                    self._paused_until = max(self._paused_until, ready)
+                    heapq.heappush(self._delayed, (ready, item.sequence, item))
+                    logging.warning(f"Rate limited by Telegram, retrying in {err.retry_after} seconds.")
+                    return
+                self.failed += 1
+            item.future.set_exception(err)
+            return
+        except Exception as err:
+            with self._condition:
+                self._release(item)
+                self.failed += 1
+            logging.error(f"Could not deliver message to {item.chat_id}: {err}")
+            item.future.set_exception(err)
+            return
+
+        latency = time.monotonic() - item.enqueued
+        with self._condition:
+            self._release(item)
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        item.future.set_result(result)
+
+    def _fail_pending(self) -> None:
+        items = [item for lane in self._lanes.values() for item in lane] + [item for _, _, item in self._delayed] \
+            + [item for parked in self._parked.values() for item in parked]
+        for lane in self._lanes.values():
+            lane.clear()
+        self._delayed.clear()
+        self._parked.clear()
+        for item in items:
+            if item.attempts == 0 and not item.future.set_running_or_notify_cancel():
+                continue
+            item.future.set_exception(RuntimeError("The send queue was stopped before delivery."))
+        if items:
+            logging.warning(f"Dropped {len(items)} undelivered messages on shutdown.")
+
+    def depth(self) -> Dict[int, int]:
+        depths = {priority: len(lane) for priority, lane in self._lanes.items()}
+        for _, _, item in list(self._delayed):
+            depths[item.priority] += 1
+        for parked in list(self._parked.values()):
+            for item in list(parked):
+                depths[item.priority] += 1
+        return depths
+
+    def stats(self) -> Dict[str, Any]:
+        depths = self.depth()
+        return {
+            'interactive': depths[INTERACTIVE],
+            'broadcast': depths[BROADCAST],
+            'in_flight': self._in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'latency_avg': self.latency_total / self.sent if self.sent else 0.0,
+            'latency_max': self.latency_max
+        }
+
+    def stop(self, timeout: float = None) -> None:
+        with self._condition:
+            self._stopped = True
+            thread = self._thread
+            self._condition.notify()
+        if thread is not None:
+            thread.join(timeout=timeout)
+            if thread.is_alive():
+                with self._condition:
+                    self._aborted = True
+                    self._condition.notify()
+                thread.join()
+        self._executor.shutdown(wait=False)
+
+
+queue = SendQueue()
+submit = queue.submit
+stats = queue.stats
+stop = queue.stop
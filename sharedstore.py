@@ -0,0 +1,250 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+import cache
+import config
+
+settings = config.section('cluster')
+
+CLUSTERED = settings.get('workers', 0) > 1
+BACKEND = settings.get('store', 'file' if CLUSTERED else 'local')
+STORE_FILE = settings.get('store_file', 'shared.db')
+STALE_GRACE = settings.get('stale_grace', 3600.0)
+PURGE_INTERVAL = 60.0
+
+
+def node_id() -> str:
+    return settings.get('node_id') or f'{socket.gethostname()}:{os.getpid()}'
+
+
+class SharedStore(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, value: Any, ttl: float = None) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def items(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        pass
+
+    @abstractmethod
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        pass
+
+    @abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class LocalStore(SharedStore):
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Optional[float], Optional[str], Any]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[Tuple[Optional[float], Optional[str], Any]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return cache.MISSING if entry is None else entry[2]
+
+    def put(self, key: str, value: Any, ttl: float = None) -> None:
+        with self._lock:
+            self._entries[key] = (None if ttl is None else time.monotonic() + ttl), None, value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def items(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            entries = [(key, self._live(key, now)) for key in keys]
+        return iter([(key, entry[2]) for key, entry in entries if entry is not None])
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None and entry[1] != owner:
+                return False
+            self._entries[key] = now + ttl, owner, None
+            return True
+
+    def release(self, key: str, owner: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == owner:
+                del self._entries[key]
+
+
+class FileStore(SharedStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value BLOB,
+            owner TEXT,
+            expires REAL
+        );
+        CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+    """
+
+    def __init__(self, filename: str = STORE_FILE):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.SCHEMA)
+        self._purged = 0.0
+
+    def _execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    def _purge(self, now: float) -> None:
+        if now - self._purged < PURGE_INTERVAL:
+            return
+        self._purged = now
+        self._execute('DELETE FROM entries WHERE expires < ?', (now,))
+
+    def get(self, key: str) -> Any:
+        row = self._execute('SELECT value FROM entries WHERE key = ? AND value IS NOT NULL '
+                            'AND (expires IS NULL OR expires >= ?)',
+                            (key, time.time())).fetchone()
+        return cache.MISSING if row is None else pickle.loads(row[0])
+
+    def put(self, key: str, value: Any, ttl: float = None) -> None:
+        now = time.time()
+        self._execute('INSERT OR REPLACE INTO entries (key, value, owner, expires) VALUES (?, ?, NULL, ?)',
+                      (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), None if ttl is None else now + ttl))
+        self._purge(now)
+
+    def delete(self, key: str) -> None:
+        self._execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def items(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        rows = self._execute("SELECT key, value FROM entries WHERE key >= ? AND key < ? AND value IS NOT NULL "
+                             "AND (expires IS NULL OR expires >= ?)",
+                             (prefix, prefix + '\uffff', time.time())).fetchall()
+        return ((key, pickle.loads(value)) for key, value in rows)
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute('SELECT owner, expires FROM entries WHERE key = ?', (key,)).fetchone()
+                claimed = row is None or row[0] == owner or (row[1] is not None and row[1] < now)
+                if claimed:
+                    self._connection.execute('INSERT OR REPLACE INTO entries (key, value, owner, expires) '
+                                             'VALUES (?, NULL, ?, ?)', (key, owner, now + ttl))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return claimed
+
+    def release(self, key: str, owner: str) -> None:
+        self._execute('DELETE FROM entries WHERE key = ? AND owner = ?', (key, owner))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class SharedCache:
+    def __init__(self, store: SharedStore, namespace: str, ttl: float = 60.0, stale_grace: float = STALE_GRACE):
+        self.store = store
+        self.prefix = f'{namespace}:'
+        self.ttl = ttl
+        self.stale_grace = stale_grace
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def _key(self, key: Hashable) -> str:
+        return self.prefix + repr(key)
+
+    def _entry(self, key: Hashable) -> Any:
+        entry = self.store.get(self._key(key))
+        if entry is cache.MISSING:
+            return None
+        return entry
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entry(key)
+        if entry is None or entry[0] < time.time():
+            self.misses += 1
+            return cache.MISSING
+        self.hits += 1
+        return entry[2]
+
+    def get_stale(self, key: Hashable) -> Any:
+        entry = self._entry(key)
+        if entry is None:
+            return cache.MISSING
+        self.stale_hits += 1
+        return entry[2]
+
+    def put(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self.store.put(self._key(key), (time.time() + ttl, key, value), ttl + self.stale_grace)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool] = None) -> int:
+        removed = 0
+        for store_key, entry in list(self.store.items(self.prefix)):
+            if predicate is None or predicate(entry[1]):
+                self.store.delete(store_key)
+                removed += 1
+        return removed
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entry(key)
+        return entry is not None and entry[0] >= time.time()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.store.items(self.prefix))
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'stale_hits': self.stale_hits,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+def open_store(backend: str = BACKEND) -> SharedStore:
+    if backend == 'local':
+        return LocalStore()
+    if backend == 'file':
+        return FileStore()
+    raise ValueError(f"Unknown shared store {backend}.")
+
+
+store: SharedStore = open_store()
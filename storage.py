@@ -0,0 +1,255 @@
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, Set
+
+import acl
+import config
+import persistence
+
+ADMINISTRATORS = 'administrators'
+WHITELIST = 'whitelist'
+BLACKLIST = 'blacklist'
+REQUESTS = 'requests'
+ROLES = [ADMINISTRATORS, WHITELIST, BLACKLIST, REQUESTS]
+
+settings = config.section('storage')
+
+CLUSTERED = config.section('cluster').get('workers', 0) > 1
+BACKEND = settings.get('backend', 'sqlite' if CLUSTERED else 'yaml')
+DATABASE = settings.get('database', 'quotesc.db')
+
+
+class Storage(ABC):
+    @abstractmethod
+    def users(self, role: str) -> Dict[int, str]:
+        pass
+
+    @abstractmethod
+    def contains(self, role: str, user_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    def add(self, role: str, user_id: int, name: str) -> None:
+        pass
+
+    @abstractmethod
+    def remove(self, role: str, user_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def subscriptions(self) -> Dict[int, str]:
+        pass
+
+    @abstractmethod
+    def subscribe(self, chat_id: int, raw_time: str) -> None:
+        pass
+
+    @abstractmethod
+    def unsubscribe(self, chat_id: int) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class YamlStorage(Storage):
+    def __init__(self):
+        self._lists = {
+            ADMINISTRATORS: acl.UserList(acl.administrators_file),
+            WHITELIST: acl.UserList(acl.whitelist_file),
+            BLACKLIST: acl.UserList(acl.blacklist_file),
+            REQUESTS: acl.UserList(acl.requests_file)
+        }
+        self._subscriptions = acl.UserList(acl.subscriptions_file)
+
+    def users(self, role: str) -> Dict[int, str]:
+        return self._lists[role].users()
+
+    def contains(self, role: str, user_id: int) -> bool:
+        return user_id in self._lists[role]
+
+    def add(self, role: str, user_id: int, name: str) -> None:
+        self._lists[role].add(user_id=user_id, name=name)
+
+    def remove(self, role: str, user_id: int) -> None:
+        self._lists[role].remove(user_id=user_id)
+
+    def subscriptions(self) -> Dict[int, str]:
+        return self._subscriptions.users()
+
+    def subscribe(self, chat_id: int, raw_time: str) -> None:
+        self._subscriptions.add(user_id=chat_id, name=raw_time)
+
+    def unsubscribe(self, chat_id: int) -> None:
+        self._subscriptions.remove(user_id=chat_id)
+
+    def flush(self) -> None:
+        persistence.flush()
+
+    def close(self) -> None:
+        persistence.stop()
+
+
+class SqliteStorage(Storage):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            role TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (role, user_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS users_user_id ON users (user_id);
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            time TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS subscriptions_time ON subscriptions (time);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, database: str = DATABASE):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.SCHEMA)
+        self._members: Dict[str, Set[int]] = {}
+        self._version = None
+        self._checked = float('-inf')
+        self._refresh()
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < acl.CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked = now
+            version = self._connection.execute('PRAGMA data_version').fetchone()[0]
+            if version == self._version:
+                return
+            members: Dict[str, Set[int]] = {role: set() for role in ROLES}
+            for role, user_id in self._connection.execute('SELECT role, user_id FROM users'):
+                members.setdefault(role, set()).add(user_id)
+            self._members = members
+            self._version = version
+
+    def _execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    def users(self, role: str) -> Dict[int, str]:
+        rows = self._execute('SELECT user_id, name FROM users WHERE role = ?', (role,)).fetchall()
+        return dict(rows)
+
+    def contains(self, role: str, user_id: int) -> bool:
+        self._refresh()
+        return user_id in self._members.get(role, ())
+
+    def add(self, role: str, user_id: int, name: str) -> None:
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO users (role, user_id, name) VALUES (?, ?, ?)',
+                                     (role, user_id, name))
+            self._members.setdefault(role, set()).add(user_id)
+
+    def remove(self, role: str, user_id: int) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM users WHERE role = ? AND user_id = ?', (role, user_id))
+            self._members.get(role, set()).discard(user_id)
+
+    def subscriptions(self) -> Dict[int, str]:
+        return dict(self._execute('SELECT chat_id, time FROM subscriptions').fetchall())
+
+    def subscribe(self, chat_id: int, raw_time: str) -> None:
+        self._execute('INSERT OR REPLACE INTO subscriptions (chat_id, time) VALUES (?, ?)', (chat_id, raw_time))
+
+    def unsubscribe(self, chat_id: int) -> None:
+        self._execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+
+    def is_migrated(self) -> bool:
+        return self._execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is not None
+
+    def import_from(self, source: Storage) -> None:
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                for role in ROLES:
+                    self._connection.executemany('INSERT OR REPLACE INTO users (role, user_id, name) VALUES (?, ?, ?)',
+                                                 [(role, user_id, name)
+                                                  for user_id, name in source.users(role).items()])
+                self._connection.executemany('INSERT OR REPLACE INTO subscriptions (chat_id, time) VALUES (?, ?)',
+                                             list(source.subscriptions().items()))
+                self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', 'yaml')")
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        self._version = None
+        self._checked = float('-inf')
+        self._refresh()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def open_storage(backend: str = BACKEND) -> Storage:
+    if backend == 'yaml':
+        return YamlStorage()
+    if backend == 'sqlite':
+        sqlite_storage = SqliteStorage()
+        if not sqlite_storage.is_migrated():
+            sqlite_storage.import_from(YamlStorage())
+            logging.info(f"Migrated YAML files into {DATABASE}.")
+        return sqlite_storage
+    raise ValueError(f"Unknown storage backend {backend}.")
+
+
+class Role:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __contains__(self, user_id: int) -> bool:
+        return backend.contains(self.name, user_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(backend.users(self.name))
+
+    def users(self) -> Dict[int, str]:
+        return backend.users(self.name)
+
+    def add(self, user_id: int, name: str) -> None:
+        backend.add(self.name, user_id, name)
+
+    def remove(self, user_id: int) -> None:
+        backend.remove(self.name, user_id)
+
+
+backend: Storage = open_storage()
+
+administrators = Role(ADMINISTRATORS)
+whitelist = Role(WHITELIST)
+blacklist = Role(BLACKLIST)
+requests = Role(REQUESTS)
+
+
+def close() -> None:
+    backend.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        print(f"Usage: {sys.argv[0]} migrate")
+        sys.exit(1)
+    target = SqliteStorage()
+    target.import_from(YamlStorage())
+    print(f"Migrated YAML files into {DATABASE}.")
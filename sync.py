@@ -0,0 +1,130 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+from telegram.ext import CallbackContext
+
+import httpclient
+import models
+import quotestore
+import restapiservice
+
+
+class SyncEngine:
+    def __init__(self,
+                 store: quotestore.QuoteStore,
+                 page_size: int = quotestore.SYNC_PAGE_SIZE,
+                 full_sync_interval: float = quotestore.FULL_SYNC_INTERVAL):
+        self.store = store
+        self.page_size = page_size
+        self.full_sync_interval = full_sync_interval
+        self.last_success = None
+        self.last_full_sync = None
+        self.bytes_total = 0
+        self.bytes_last = 0
+        self.quotes_applied = 0
+        self.persons_applied = 0
+        self.full_syncs = 0
+        self.delta_syncs = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self, path: str, params: Dict[str, Any], decode: Callable[[List[Dict]], List]) -> List:
+        response = httpclient.get(session=restapiservice.session,
+                                  url=restapiservice.BASE_URL + path,
+                                  path=path,
+                                  headers=restapiservice.ACCEPT_APPLICATION_JSON,
+                                  params=params)
+        response.raise_for_status()
+        self.bytes_last += len(response.content)
+        return decode(json.loads(response.content))
+
+    def _pages(self, path: str, params: Dict[str, Any], decode: Callable[[List[Dict]], List]) -> Iterator[List]:
+        page = 1
+        while True:
+            items = self._fetch(path, {**params,
+                                       '_sort': 'id',
+                                       '_order': 'asc',
+                                       '_page': page,
+                                       '_limit': self.page_size}, decode)
+            yield items
+            if len(items) < self.page_size:
+                return
+            page += 1
+
+    def full_sync(self) -> None:
+        self.quotes_applied += self.store.sync(self._pages(restapiservice.QUOTES_PATH, {}, models.decode_quotes))
+        pages = self._pages(restapiservice.PERSONS_PATH, {}, models.decode_persons)
+        persons = [person for page in pages for person in page]
+        self.persons_applied += self.store.sync_persons(persons)
+        self.store.ready = True
+        self.full_syncs += 1
+        self.last_full_sync = time.monotonic()
+
+    def full_sync_due(self) -> bool:
+        return (not self.store.ready
+                or self.last_full_sync is None
+                or time.monotonic() - self.last_full_sync >= self.full_sync_interval)
+
+    def delta_sync(self) -> None:
+        quotes = 0
+        for page in self._pages(restapiservice.QUOTES_PATH,
+                                {'id_gte': self.store.watermark() + 1},
+                                models.decode_quotes):
+            quotes += self.store.apply(page)
+        persons = 0
+        for page in self._pages(restapiservice.PERSONS_PATH,
+                                {'id_gte': self.store.person_watermark() + 1},
+                                models.decode_persons):
+            persons += self.store.apply_persons(page)
+        self.quotes_applied += quotes
+        self.persons_applied += persons
+        self.delta_syncs += 1
+        if quotes or persons:
+            logging.info(f"Applied {quotes} new quotes and {persons} new persons.")
+
+    def run(self) -> None:
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.bytes_last = 0
+            if self.full_sync_due():
+                self.full_sync()
+            else:
+                self.delta_sync()
+            self.bytes_total += self.bytes_last
+            self.last_success = time.monotonic()
+        except Exception as err:
+            self.failures += 1
+            logging.warning(f"Quote sync failed: {err}")
+        finally:
+            self._lock.release()
+
+    def lag(self) -> float:
+        if self.last_success is None:
+            return float('inf')
+        return time.monotonic() - self.last_success
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'ready': self.store.ready,
+            'quotes': len(self.store),
+            'watermark': self.store.watermark(),
+            'lag': self.lag(),
+            'bytes_last': self.bytes_last,
+            'bytes_total': self.bytes_total,
+            'quotes_applied': self.quotes_applied,
+            'persons_applied': self.persons_applied,
+            'full_syncs': self.full_syncs,
+            'delta_syncs': self.delta_syncs,
+            'failures': self.failures
+        }
+
+
+engine = SyncEngine(quotestore.store)
+
+
+def sync_job(context: CallbackContext) -> None:
+    threading.Thread(target=engine.run, name='quote-sync', daemon=True).start()
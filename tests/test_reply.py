@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+from telegram import Update
+from telegram.ext import CallbackContext, Updater
+
+import aio
+import messages
+import utils
+from fake_telegram import FakeTelegram
+
+TOKEN = '123456:TESTTOKEN'
+
+
+@pytest.fixture
+def fake():
+    server = FakeTelegram(port=0).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def loop():
+    aio.start()
+    yield
+    aio.stop()
+
+
+def test_async_reply_dispatches_errors(fake, loop):
+    updater = Updater(token=TOKEN, base_url=f'http://127.0.0.1:{fake.server_port}/bot', use_context=True)
+    errors = []
+    dispatched = threading.Event()
+
+    def error_handler(update: Update, context: CallbackContext) -> None:
+        errors.append((update, context.error))
+        dispatched.set()
+
+    async def fetch_async():
+        raise RuntimeError('backend down')
+
+    updater.dispatcher.add_error_handler(error_handler)
+    message = fake.message(300, text='/random')
+    message['from'] = {'id': 1000, 'is_bot': False, 'first_name': 'User'}
+    update = Update.de_json({'update_id': 1, 'message': message}, updater.bot)
+    utils.reply_async(context=CallbackContext(updater.dispatcher),
+                      chat_id=300,
+                      name='random',
+                      fetch=lambda: None,
+                      fetch_async=fetch_async,
+                      render=str,
+                      update=update,
+                      dispatcher=updater.dispatcher)
+
+    assert dispatched.wait(5)
+    assert errors[0][0] is update
+    assert str(errors[0][1]) == 'backend down'
+    deadline = time.monotonic() + 5
+    while not fake.replies and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert [(reply['chat_id'], reply['text']) for reply in fake.replies] == [(300, messages.ERROR_OCCURRED)]
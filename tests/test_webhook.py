@@ -0,0 +1,90 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from telegram import Bot, Update
+from telegram.ext import CommandHandler, Updater
+
+import webhook
+from fake_telegram import FakeTelegram, SECRET_HEADER
+
+TOKEN = '123456:TESTTOKEN'
+SECRET = 's3cret'
+
+
+@pytest.fixture
+def fake():
+    server = FakeTelegram(port=0).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def base_url(fake: FakeTelegram) -> str:
+    return f'http://127.0.0.1:{fake.server_port}/bot'
+
+
+def echo(bot: Bot, update: Update) -> None:
+    bot.send_message(chat_id=update.message.chat_id, text=f'echo {update.message.text}')
+
+
+@pytest.fixture
+def server(fake):
+    bot = Bot(TOKEN, base_url=base_url(fake))
+    server = webhook.WebhookServer(lambda data: echo(bot, Update.de_json(data, bot)), port=0, secret=SECRET)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server: webhook.WebhookServer, body: bytes, secret: str = SECRET, path: str = None) -> int:
+    request = urllib.request.Request(f'http://127.0.0.1:{server.server_port}{path or server.url_path}',
+                                     data=body,
+                                     headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as err:
+        return err.code
+
+
+def test_webhook_replies(fake, server):
+    bot = Bot(TOKEN, base_url=base_url(fake))
+    bot.set_webhook(url=f'http://127.0.0.1:{server.server_port}{server.url_path}', secret_token=SECRET)
+    for number in range(5):
+        fake.push(text='/help', chat_id=100 + number, user_id=1000)
+
+    assert fake.wait(5, timeout=10)
+    assert sorted(reply['chat_id'] for reply in fake.replies) == [100, 101, 102, 103, 104]
+    assert {reply['text'] for reply in fake.replies} == {'echo /help'}
+    assert server.received == 5
+
+
+def test_webhook_rejects_bad_requests(server):
+    update = json.dumps({'update_id': 1}).encode()
+
+    assert post(server, update, secret='wrong') == 403
+    assert post(server, update, path='/other') == 404
+    assert post(server, b'not json') == 400
+    assert post(server, b'[1, 2]') == 400
+    assert post(server, b'"text"') == 400
+    assert server.rejected == 1
+    assert server.received == 0
+
+
+def test_polling_replies(fake):
+    updater = Updater(token=TOKEN, base_url=base_url(fake), use_context=True)
+    updater.dispatcher.add_handler(CommandHandler('help', lambda update, context: echo(context.bot, update)))
+    updater.start_polling(poll_interval=0, timeout=1)
+    try:
+        assert fake.connected.wait(5)
+        for number in range(3):
+            fake.push(text='/help', chat_id=200 + number, user_id=1000)
+        assert fake.wait(3, timeout=10)
+    finally:
+        updater.stop()
+
+    assert sorted(reply['chat_id'] for reply in fake.replies) == [200, 201, 202]
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Hashable, Optional
+
+import config
+
+ALLOWED = 'allowed'
+DROP = 'drop'
+WARN = 'warn'
+
+settings = config.section('throttle')
+
+ENABLED = settings.get('enabled', True)
+WINDOW = settings.get('window', 10.0)
+USER_LIMIT = settings.get('user_limit', 15)
+CHAT_LIMIT = settings.get('chat_limit', 30)
+COMMAND_LIMITS: Dict[str, int] = {
+    'quotes': 5,
+    'random': 5,
+    'persons': 5,
+    'page': 10,
+    **settings.get('commands', {})
+}
+ACTION = settings.get('action', WARN)
+QUERY_NAMES = {'Q': 'page', 'P': 'person', 'A': 'accept', 'D': 'deny'}
+PRUNE_INTERVAL = 60.0
+
+
+def command_name(text: str) -> str:
+    return text.split(maxsplit=1)[0].lstrip('/').split('@', 1)[0].lower() if text else ''
+
+
+def query_name(data: str) -> str:
+    return QUERY_NAMES.get(data[:1], 'query') if data else 'query'
+
+
+class SlidingWindow:
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._events: Dict[Hashable, Deque[float]] = {}
+
+    def full(self, key: Hashable, now: float) -> bool:
+        events = self._events.get(key)
+        if events is None:
+            return False
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return len(events) >= self.limit
+
+    def add(self, key: Hashable, now: float) -> None:
+        self._events.setdefault(key, deque()).append(now)
+
+    def prune(self, now: float) -> None:
+        for key in [key for key, events in self._events.items() if not events or events[-1] <= now - self.window]:
+            del self._events[key]
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+class Throttle:
+    def __init__(self,
+                 window: float = WINDOW,
+                 user_limit: int = USER_LIMIT,
+                 chat_limit: int = CHAT_LIMIT,
+                 command_limits: Dict[str, int] = None,
+                 action: str = ACTION):
+        self.window = window
+        self.action = action
+        self._users = SlidingWindow(user_limit, window)
+        self._chats = SlidingWindow(chat_limit, window)
+        self._commands = {name: SlidingWindow(limit, window)
+                          for name, limit in (COMMAND_LIMITS if command_limits is None else command_limits).items()}
+        self._warned: Dict[int, float] = {}
+        self._pruned = time.monotonic()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = Counter()
+        self.reasons = Counter()
+        self.warnings = 0
+
+    def _reason(self, user_id: int, chat_id: int, name: str, now: float) -> Optional[str]:
+        commands = self._commands.get(name)
+        if commands is not None and commands.full(user_id, now):
+            return 'command'
+        if self._users.full(user_id, now):
+            return 'user'
+        if self._chats.full(chat_id, now):
+            return 'chat'
+        return None
+
+    def check(self, user_id: int, chat_id: int, name: str) -> str:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned >= PRUNE_INTERVAL:
+                self._prune(now)
+            reason = self._reason(user_id, chat_id, name, now)
+            if reason is None:
+                commands = self._commands.get(name)
+                if commands is not None:
+                    commands.add(user_id, now)
+                self._users.add(user_id, now)
+                self._chats.add(chat_id, now)
+                self.allowed += 1
+                return ALLOWED
+            self.throttled[name] += 1
+            self.reasons[reason] += 1
+            if self.action == WARN and self._warned.get(user_id, 0.0) <= now:
+                self._warned[user_id] = now + self.window
+                self.warnings += 1
+                return WARN
+            return DROP
+
+    def _prune(self, now: float) -> None:
+        self._pruned = now
+        self._users.prune(now)
+        self._chats.prune(now)
+        for commands in self._commands.values():
+            commands.prune(now)
+        for user_id in [user_id for user_id, until in self._warned.items() if until <= now]:
+            del self._warned[user_id]
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'throttled': sum(self.throttled.values()),
+                'commands': dict(self.throttled),
+                'reasons': dict(self.reasons),
+                'warnings': self.warnings,
+                'tracked_users': len(self._users),
+                'tracked_chats': len(self._chats)
+            }
+
+
+throttle = Throttle()
+stats = throttle.stats
+
+
+def check(user_id: int, chat_id: int, name: str) -> str:
+    if not ENABLED:
+        return ALLOWED
+    return throttle.check(user_id, chat_id, name)
@@ -1,15 +1,25 @@
 import logging
-from typing import Dict
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import yaml
 from telegram import Update
 from telegram.ext import CallbackContext
 
+import acl
+import logs
 import messages
 from utils import send_text_async, send_sticker_async
 
 secrets_file = 'secrets.yml'
 
+CHECK_INTERVAL = 1.0
+TRAILING = "?!."
+WORD_PATTERN = re.compile(r'\w+')
+
 
 def read(filename: str) -> Dict[str, Dict[str, str]]:
     try:
@@ -19,29 +29,146 @@ def read(filename: str) -> Dict[str, Dict[str, str]]:
         return {}
 
 
+def normalize(text: str) -> str:
+    return text.strip().rstrip(TRAILING).lower()
+
+
+def normalize_phrase(text: str) -> str:
+    return f" {' '.join(WORD_PATTERN.findall(text.lower()))} "
+
+
+class PhraseMatcher:
+    def __init__(self, phrases: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]
+        for phrase in phrases:
+            self._add(phrase)
+        self._link()
+
+    def _add(self, phrase: str) -> None:
+        state = 0
+        for char in phrase:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = following
+        self._output[state] = phrase
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                if self._output[following] is None:
+                    self._output[following] = self._output[self._fail[following]]
+
+    def find(self, text: str) -> Optional[str]:
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
+class SecretTable:
+    __slots__ = ('texts', 'stickers', 'phrases', 'matcher')
+
+    def __init__(self, secrets: Dict[str, Dict[str, str]]):
+        self.texts = {normalize(str(trigger)): answer for trigger, answer in (secrets.get('texts') or {}).items()}
+        self.stickers = dict(secrets.get('stickers') or {})
+        phrases = [(normalize_phrase(str(trigger)), answer)
+                   for trigger, answer in (secrets.get('phrases') or {}).items()]
+        self.phrases = {phrase: answer for phrase, answer in phrases if phrase.strip()}
+        self.matcher = PhraseMatcher(self.phrases) if self.phrases else None
+
+
+class Secrets:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._table = SecretTable({})
+        self._mtime: Optional[int] = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked = now
+            mtime = acl.modification_time(self.filename)
+            if mtime == self._mtime:
+                return
+            try:
+                self.load(read(self.filename))
+            except yaml.YAMLError as err:
+                logging.warning(f"Could not load {self.filename}, keeping the previous secrets: {err}")
+                return
+            self._mtime = mtime
+            table = self._table
+            logging.info(f"Loaded {len(table.texts)} texts, {len(table.phrases)} phrases "
+                         f"and {len(table.stickers)} stickers from {self.filename}.")
+
+    def load(self, secrets: Dict[str, Dict[str, str]]) -> None:
+        self._table = SecretTable(secrets)
+
+    def text(self, text: str) -> Optional[Tuple[str, str]]:
+        self._refresh()
+        table = self._table
+        key = normalize(text)
+        answer = table.texts.get(key)
+        if answer is not None:
+            return key, answer
+        if table.matcher is not None:
+            phrase = table.matcher.find(normalize_phrase(text))
+            if phrase is not None:
+                return phrase.strip(), table.phrases[phrase]
+        return None
+
+    def sticker(self, file_id: str) -> Optional[str]:
+        self._refresh()
+        return self._table.stickers.get(file_id)
+
+
+secrets = Secrets(secrets_file)
+
+
 def top_secret_text_handler(update: Update, context: CallbackContext) -> None:
-    text: str = update.message.text
-    while text[-1] in "?!.":
-        text = text[:-1]
-    secrets = read(secrets_file)['texts']
-    if text.lower() in secrets:
-        logging.info(f"{messages.USERNAME(update.message.from_user)} discovered secret {text}!")
+    text: str = update.message.text or ''
+    match = secrets.text(text)
+    if match is not None:
+        trigger, answer = match
+        logging.info(f"{messages.USERNAME(update.message.from_user)} discovered secret {trigger}!")
         send_text_async(bot=context.bot,
                         chat_id=update.message.chat_id,
-                        text=secrets[text.lower()],
+                        text=answer,
                         reply_to_message_id=update.message.message_id)
     else:
-        logging.info(f"{messages.USERNAME(update.message.from_user)} sent {text}!")
+        logs.sent.info(f"{messages.USERNAME(update.message.from_user)} sent {text}!")
 
 
 def top_secret_sticker_handler(update: Update, context: CallbackContext) -> None:
     sticker: str = update.message.sticker.file_id
-    secrets = read(secrets_file)['stickers']
-    if sticker in secrets:
+    answer = secrets.sticker(sticker)
+    if answer is not None:
         logging.info(f"{messages.USERNAME(update.message.from_user)} discovered secret sticker {sticker}!")
         send_sticker_async(bot=context.bot,
                            chat_id=update.message.chat_id,
-                           sticker=secrets[sticker],
+                           sticker=answer,
                            reply_to_message_id=update.message.message_id)
     else:
-        logging.info(f"{messages.USERNAME(update.message.from_user)} sent {sticker}!")
+        logs.sent.info(f"{messages.USERNAME(update.message.from_user)} sent {sticker}!")
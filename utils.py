@@ -1,59 +1,55 @@
+import asyncio
 import logging
-from typing import Union, Callable, Dict
+from collections import Counter
+from concurrent.futures import Future
+from typing import Union, Callable, Dict, Any, Optional, Awaitable, Hashable
 
-import yaml
-from telegram import Bot, InlineKeyboardMarkup, Update, Message, User, InlineKeyboardButton, ReplyMarkup, Chat, Sticker
-from telegram.ext import CallbackContext
-from telegram.ext.dispatcher import run_async
+from telegram import Bot, InlineKeyboardMarkup, Update, Message, User, InlineKeyboardButton, ReplyMarkup, Chat, \
+    Sticker, CallbackQuery
+from telegram.ext import CallbackContext, Dispatcher
 
+import aio
+import config
 import messages
+import metrics
+import notify
+import sendqueue
+import storage
+import throttle
 
-administrators_file = 'administrators.yml'
-blacklist_file = 'blacklist.yml'
-whitelist_file = 'whitelist.yml'
-requests_file = 'requests.yml'
+REPLY_DEADLINE = config.section('reply').get('deadline', 0.5)
 
+reply_stats = Counter()
 
-def read(filename: str) -> Dict[int, str]:
-    try:
-        with open(filename, encoding='UTF-8') as file:
-            return yaml.safe_load(file) or {}
-    except FileNotFoundError:
-        return {}
+
+def read(role: storage.Role) -> Dict[int, str]:
+    return role.users()
 
 
-def append(filename: str, user_chat: Union[User, Chat]) -> None:
-    with open(filename, encoding='UTF-8') as file:
-        users: Dict = yaml.safe_load(file) or {}
-    users.update({user_chat.id: messages.USERNAME(user_chat)})
-    with open(filename, mode='w', encoding='UTF-8') as file:
-        yaml.safe_dump(users, file, allow_unicode=True)
+def append(role: storage.Role, user_chat: Union[User, Chat]) -> None:
+    role.add(user_id=user_chat.id,
+             name=messages.USERNAME(user_chat))
 
 
-def remove(filename: str, user_chat: Union[User, Chat]) -> None:
-    with open(filename, encoding='UTF-8') as file:
-        users: Dict = yaml.safe_load(file) or {}
-    if user_chat.id in users:
-        users.pop(user_chat.id)
-        with open(filename, mode='w', encoding='UTF-8') as file:
-            yaml.safe_dump(users, file, allow_unicode=True)
+def remove(role: storage.Role, user_chat: Union[User, Chat]) -> None:
+    role.remove(user_id=user_chat.id)
 
 
 def whitelist(user_chat: Union[User, Chat], chat_id: int, context: CallbackContext) -> bool:
-    if user_chat.id in read(whitelist_file) or user_chat.id in read(administrators_file):
+    if user_chat.id in storage.whitelist or user_chat.id in storage.administrators:
         send_text_async(bot=context.bot,
                         chat_id=chat_id,
                         text=messages.ALREADY_WHITELISTED(user_chat))
         return False
 
-    if user_chat.id in read(blacklist_file):
-        remove(filename=blacklist_file,
+    if user_chat.id in storage.blacklist:
+        remove(role=storage.blacklist,
                user_chat=user_chat)
 
-    append(filename=whitelist_file,
+    append(role=storage.whitelist,
            user_chat=user_chat)
 
-    remove(filename=requests_file,
+    remove(role=storage.requests,
            user_chat=user_chat)
 
     send_text_async(bot=context.bot,
@@ -64,26 +60,26 @@ def whitelist(user_chat: Union[User, Chat], chat_id: int, context: CallbackConte
 
 
 def blacklist(user_chat: Union[User, Chat], chat_id: int, context: CallbackContext) -> bool:
-    if user_chat.id in read(administrators_file):
+    if user_chat.id in storage.administrators:
         send_text_async(bot=context.bot,
                         chat_id=chat_id,
                         text=messages.CANNOT_BLACKLIST_ADMINISTRATOR)
         return False
 
-    if user_chat.id in read(blacklist_file):
+    if user_chat.id in storage.blacklist:
         send_text_async(bot=context.bot,
                         chat_id=chat_id,
                         text=messages.ALREADY_BLACKLISTED(user_chat))
         return False
 
-    if user_chat.id in read(whitelist_file):
-        remove(filename=whitelist_file,
+    if user_chat.id in storage.whitelist:
+        remove(role=storage.whitelist,
                user_chat=user_chat)
 
-    append(filename=blacklist_file,
+    append(role=storage.blacklist,
            user_chat=user_chat)
 
-    remove(filename=requests_file,
+    remove(role=storage.requests,
            user_chat=user_chat)
 
     send_text_async(bot=context.bot,
@@ -94,13 +90,13 @@ def blacklist(user_chat: Union[User, Chat], chat_id: int, context: CallbackConte
 
 
 def is_authorized(user_chat: Union[User, Chat], chat_id: int, context: CallbackContext) -> bool:
-    if user_chat.id in read(administrators_file) or user_chat.id in read(whitelist_file):
+    if user_chat.id in storage.administrators or user_chat.id in storage.whitelist:
         return True
-    if user_chat.id in read(requests_file):
+    if user_chat.id in storage.requests:
         send_text_async(bot=context.bot,
                         chat_id=chat_id,
                         text=messages.PENDING)
-    elif user_chat.id in read(blacklist_file):
+    elif user_chat.id in storage.blacklist:
         send_text_async(bot=context.bot,
                         chat_id=chat_id,
                         text=messages.BLACKLISTED)
@@ -108,7 +104,7 @@ def is_authorized(user_chat: Union[User, Chat], chat_id: int, context: CallbackC
         send_text_async(bot=context.bot,
                         chat_id=chat_id,
                         text=messages.NOT_WHITELISTED)
-        append(filename=requests_file,
+        append(role=storage.requests,
                user_chat=user_chat)
         keyboard = [[InlineKeyboardButton("Deny", callback_data=f"D{chat_id}"),
                      InlineKeyboardButton("Accept", callback_data=f"A{chat_id}")]]
@@ -120,52 +116,78 @@ def is_authorized(user_chat: Union[User, Chat], chat_id: int, context: CallbackC
 
 
 def is_whitelisted(user_id: int) -> bool:
-    return user_id in read(whitelist_file)
+    return user_id in storage.whitelist
 
 
 def is_blacklisted(user_id: int) -> bool:
-    return user_id in read(blacklist_file)
+    return user_id in storage.blacklist
+
+
+def is_command_throttled(update: Update, context: CallbackContext) -> bool:
+    decision = throttle.check(update.message.from_user.id,
+                              update.message.chat_id,
+                              throttle.command_name(update.message.text))
+    if decision == throttle.WARN:
+        send_text_async(bot=context.bot,
+                        chat_id=update.message.chat_id,
+                        text=messages.THROTTLED)
+    return decision != throttle.ALLOWED
+
+
+def is_query_throttled(update: Update, context: CallbackContext) -> bool:
+    query: CallbackQuery = update.callback_query
+    decision = throttle.check(query.from_user.id,
+                              query.message.chat_id,
+                              throttle.query_name(query.data))
+    if decision != throttle.ALLOWED:
+        answer_async(bot=context.bot,
+                     query=query,
+                     text=messages.THROTTLED)
+    return decision != throttle.ALLOWED
 
 
 def command_handler(handler: Callable[[Update, CallbackContext], None]) -> Callable[[Update, CallbackContext], None]:
     def func(update: Update, context: CallbackContext) -> None:
         if update.edited_message:
             return
+        if is_command_throttled(update, context):
+            return
         try:
             logging.info(f"Command {update.message.text} by {messages.USERNAME(update.message.from_user)}")
             if is_authorized(update.message.from_user, update.message.chat_id, context):
                 handler(update, context)
         except Exception as err:
-            if update.message.from_user.id not in read(administrators_file):
+            if update.message.from_user.id not in storage.administrators:
                 send_text_async(bot=context.bot,
-                                chat_id=update.callback_query.message.chat_id,
+                                chat_id=update.message.chat_id,
                                 text=messages.ERROR_OCCURRED)
             raise err
 
-    return func
+    return metrics.timed(metrics.handler_seconds, handler.__name__)(func)
 
 
 def query_handler(handler: Callable[[Update, CallbackContext], None]) -> Callable[[Update, CallbackContext], None]:
     def func(update: Update, context: CallbackContext) -> None:
+        if is_query_throttled(update, context):
+            return
         try:
             logging.info(f"Query {update.callback_query.data} by {messages.USERNAME(update.callback_query.from_user)}")
             if is_authorized(update.callback_query.from_user, update.callback_query.message.chat_id, context):
                 handler(update, context)
         except Exception as err:
-            if update.callback_query.from_user.id not in read(administrators_file):
+            if update.callback_query.from_user.id not in storage.administrators:
                 send_text_async(bot=context.bot,
                                 chat_id=update.callback_query.message.chat_id,
                                 text=messages.ERROR_OCCURRED)
             raise err
 
-    return func
+    return metrics.timed(metrics.handler_seconds, handler.__name__)(func)
 
 
 def admin_command_handler(handler: Callable[[Update, CallbackContext], None]) \
         -> Callable[[Update, CallbackContext], None]:
-    @command_handler
     def func(update: Update, context: CallbackContext) -> None:
-        if update.message.chat_id in read(administrators_file):
+        if update.message.chat_id in storage.administrators:
             handler(update, context)
         else:
             send_text_async(bot=context.bot,
@@ -173,81 +195,241 @@ def admin_command_handler(handler: Callable[[Update, CallbackContext], None]) \
                             text=messages.NO_PERMISSION)
             user = update.message.from_user
             command = update.message.text
+            name = throttle.command_name(command)
             send_admins_async(text=messages.NO_PERMISSION_REPORT(user_chat=user,
                                                                  command=command),
-                              bot=context.bot)
+                              bot=context.bot,
+                              key=('permission', name),
+                              summary=messages.NO_PERMISSION_SUMMARY(f'/{name}'),
+                              detail=messages.USERNAME(user))
 
-    return func
+    func.__name__ = handler.__name__
+    return command_handler(func)
 
 
 def admin_query_handler(handler: Callable[[Update, CallbackContext], None]) \
         -> Callable[[Update, CallbackContext], None]:
-    @query_handler
     def func(update: Update, context: CallbackContext) -> None:
-        if update.callback_query.message.chat_id in read(administrators_file):
+        if update.callback_query.message.chat_id in storage.administrators:
             handler(update, context)
         else:
             send_text_async(bot=context.bot,
-                            chat_id=update.message.chat_id,
+                            chat_id=update.callback_query.message.chat_id,
                             text=messages.NO_PERMISSION)
             user = update.callback_query.from_user
-            command = update.message.text
+            data = update.callback_query.data
+            name = throttle.query_name(data)
             send_admins_async(text=messages.NO_PERMISSION_REPORT(user_chat=user,
-                                                                 command=command),
-                              bot=context.bot)
+                                                                 command=data),
+                              bot=context.bot,
+                              key=('permission', name),
+                              summary=messages.NO_PERMISSION_SUMMARY(f'{name} query'),
+                              detail=messages.USERNAME(user))
 
-    return func
+    func.__name__ = handler.__name__
+    return query_handler(func)
 
 
 def send_admins_async(text: str,
                       bot: Bot,
-                      reply_markup: InlineKeyboardMarkup = None):
-    for chat_id in read(administrators_file):
-        send_text_async(bot=bot,
-                        chat_id=chat_id,
-                        text=text,
-                        reply_markup=reply_markup)
+                      reply_markup: InlineKeyboardMarkup = None,
+                      key: Hashable = None,
+                      summary: str = None,
+                      detail: str = None):
+    notify.notify(bot=bot,
+                  text=text,
+                  reply_markup=reply_markup,
+                  key=key,
+                  summary=summary,
+                  detail=detail)
 
 
-@run_async
 def send_text_async(bot: Bot,
                     chat_id: Union[int, str],
                     text: str,
                     disable_web_page_preview: bool = True,
                     reply_to_message_id: int = None,
-                    reply_markup: ReplyMarkup = None):
-    return bot.sendMessage(chat_id=chat_id,
-                           text=text,
-                           display_web_page_preview=disable_web_page_preview,
-                           reply_to_message_id=reply_to_message_id,
-                           reply_markup=reply_markup)
+                    reply_markup: ReplyMarkup = None,
+                    priority: int = sendqueue.INTERACTIVE) -> Future:
+    return sendqueue.submit(call=lambda: bot.sendMessage(chat_id=chat_id,
+                                                         text=text,
+                                                         display_web_page_preview=disable_web_page_preview,
+                                                         reply_to_message_id=reply_to_message_id,
+                                                         reply_markup=reply_markup),
+                            chat_id=chat_id,
+                            priority=priority)
 
 
-@run_async
 def send_sticker_async(bot: Bot,
                        chat_id: Union[int, str],
                        sticker: Union[str, Sticker],
-                       reply_to_message_id: int = None):
-    return bot.sendSticker(chat_id=chat_id,
-                           sticker=sticker,
-                           reply_to_message_id=reply_to_message_id)
+                       reply_to_message_id: int = None) -> Future:
+    return sendqueue.submit(call=lambda: bot.sendSticker(chat_id=chat_id,
+                                                         sticker=sticker,
+                                                         reply_to_message_id=reply_to_message_id),
+                            chat_id=chat_id)
+
+
+def answer_async(bot: Bot,
+                 query: CallbackQuery,
+                 text: str = None) -> Future:
+    return sendqueue.submit(call=lambda: bot.answerCallbackQuery(callback_query_id=query.id,
+                                                                 text=text),
+                            chat_id=query.message.chat_id)
 
 
-@run_async
 def edit_async(text: str,
                bot: Bot,
                message: Message,
                disable_web_page_preview: bool = None,
-               reply_markup: ReplyMarkup = None):
-    return bot.editMessageText(text=text,
-                               chat_id=message.chat_id,
-                               message_id=message.message_id,
-                               display_web_page_preview=disable_web_page_preview,
-                               reply_markup=reply_markup)
+               reply_markup: ReplyMarkup = None) -> Future:
+    return sendqueue.submit(call=lambda: bot.editMessageText(text=text,
+                                                             chat_id=message.chat_id,
+                                                             message_id=message.message_id,
+                                                             display_web_page_preview=disable_web_page_preview,
+                                                             reply_markup=reply_markup),
+                            chat_id=message.chat_id)
+
+
+def send_placeholder(bot: Bot, chat_id: Union[int, str], message: Optional[Message]) -> Future:
+    if message is None:
+        return sendqueue.submit(call=lambda: bot.sendMessage(chat_id=chat_id,
+                                                             text=messages.LOADING),
+                                chat_id=chat_id,
+                                delay=REPLY_DEADLINE)
+    return sendqueue.submit(call=lambda: bot.editMessageText(text=messages.LOADING,
+                                                             chat_id=message.chat_id,
+                                                             message_id=message.message_id),
+                            chat_id=chat_id,
+                            delay=REPLY_DEADLINE)
+
+
+def send_reply(bot: Bot,
+               chat_id: Union[int, str],
+               text: str,
+               reply_markup: Optional[ReplyMarkup],
+               message: Optional[Message],
+               disable_web_page_preview: bool) -> None:
+    if message is None:
+        send_text_async(bot=bot,
+                        chat_id=chat_id,
+                        text=text,
+                        disable_web_page_preview=disable_web_page_preview,
+                        reply_markup=reply_markup)
+    else:
+        edit_async(text=text,
+                   bot=bot,
+                   message=message,
+                   disable_web_page_preview=disable_web_page_preview,
+                   reply_markup=reply_markup)
+
+
+def reply_async(context: CallbackContext,
+                chat_id: Union[int, str],
+                name: str,
+                fetch: Callable[[], Any],
+                render: Callable[[Any], str],
+                markup: Callable[[Any], Optional[ReplyMarkup]] = None,
+                message: Message = None,
+                disable_web_page_preview: bool = True,
+                fetch_async: Callable[[], Awaitable[Any]] = None,
+                then: Callable[[Any], None] = None,
+                update: Update = None,
+                dispatcher: Dispatcher = None) -> None:
+    if fetch_async is not None and aio.running():
+        aio.submit(reply_coroutine(context=context,
+                                   chat_id=chat_id,
+                                   name=name,
+                                   fetch_async=fetch_async,
+                                   render=render,
+                                   markup=markup,
+                                   message=message,
+                                   disable_web_page_preview=disable_web_page_preview,
+                                   then=then,
+                                   update=update,
+                                   dispatcher=dispatcher))
+        return
+
+    placeholder = send_placeholder(bot=context.bot,
+                                   chat_id=chat_id,
+                                   message=message)
+    try:
+        data = fetch()
+        text = render(data)
+        reply_markup = markup(data) if markup else None
+    except Exception:
+        placeholder.cancel()
+        raise
+
+    if placeholder.cancel():
+        reply_stats[name, 'direct'] += 1
+    else:
+        reply_stats[name, 'placeholder'] += 1
+        if message is None:
+            message = placeholder.result()
+        else:
+            placeholder.exception()
+
+    send_reply(bot=context.bot,
+               chat_id=chat_id,
+               text=text,
+               reply_markup=reply_markup,
+               message=message,
+               disable_web_page_preview=disable_web_page_preview)
+    if then is not None:
+        then(data)
+
+
+async def reply_coroutine(context: CallbackContext,
+                          chat_id: Union[int, str],
+                          name: str,
+                          fetch_async: Callable[[], Awaitable[Any]],
+                          render: Callable[[Any], str],
+                          markup: Callable[[Any], Optional[ReplyMarkup]],
+                          message: Optional[Message],
+                          disable_web_page_preview: bool,
+                          then: Optional[Callable[[Any], None]],
+                          update: Optional[Update],
+                          dispatcher: Optional[Dispatcher]) -> None:
+    placeholder = send_placeholder(bot=context.bot,
+                                   chat_id=chat_id,
+                                   message=message)
+    try:
+        data = await fetch_async()
+        text = render(data)
+        reply_markup = markup(data) if markup else None
+
+        if placeholder.cancel():
+            reply_stats[name, 'direct'] += 1
+        else:
+            reply_stats[name, 'placeholder'] += 1
+            if message is None:
+                message = await asyncio.wrap_future(placeholder)
+            else:
+                await asyncio.wait([asyncio.wrap_future(placeholder)])
+
+        send_reply(bot=context.bot,
+                   chat_id=chat_id,
+                   text=text,
+                   reply_markup=reply_markup,
+                   message=message,
+                   disable_web_page_preview=disable_web_page_preview)
+        if then is not None:
+            then(data)
+    except Exception as err:
+        placeholder.cancel()
+        if update is not None and update.effective_user.id not in storage.administrators:
+            send_text_async(bot=context.bot,
+                            chat_id=chat_id,
+                            text=messages.ERROR_OCCURRED)
+        if dispatcher is None:
+            logging.exception(err)
+        else:
+            dispatcher.dispatch_error(update, err)
 
 
-@run_async
 def remove_markup(bot: Bot,
-                  message: Message) -> None:
-    bot.editMessageReplyMarkup(chat_id=message.chat_id,
-                               message_id=message.message_id)
+                  message: Message) -> Future:
+    return sendqueue.submit(call=lambda: bot.editMessageReplyMarkup(chat_id=message.chat_id,
+                                                                    message_id=message.message_id),
+                            chat_id=message.chat_id)
@@ -0,0 +1,116 @@
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import config
+
+settings = config.section('telegram')
+
+MODE = settings.get('mode', 'polling')
+BASE_URL = settings.get('base_url')
+LISTEN = settings.get('listen', '127.0.0.1')
+PORT = settings.get('port', 8443)
+PATH = settings.get('path', '/telegram')
+URL = settings.get('url')
+SECRET = settings.get('secret')
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handle: Callable[[Dict], None], listen: str = LISTEN, port: int = PORT, path: str = PATH,
+                 secret: Optional[str] = SECRET):
+        super().__init__((listen, port), WebhookHandler)
+        self.handle = handle
+        self.url_path = path if path.startswith('/') else f'/{path}'
+        self.secret = secret
+        self.received = 0
+        self.rejected = 0
+
+    def authorized(self, token: Optional[str]) -> bool:
+        if not self.secret:
+            return True
+        return token is not None and hmac.compare_digest(token.encode(), self.secret.encode())
+
+    def dispatch(self, data: Dict) -> None:
+        self.handle(data)
+        self.received += 1
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def do_POST(self) -> None:
+        if self.path != self.server.url_path:
+            self.send_response(404)
+        elif not self.server.authorized(self.headers.get(SECRET_HEADER)):
+            self.server.rejected += 1
+            logging.warning(f"Rejected webhook request from {self.client_address[0]} with a wrong secret.")
+            self.send_response(403)
+        else:
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                data = json.loads(self.rfile.read(length))
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                self.send_response(400)
+            else:
+                try:
+                    self.server.dispatch(data)
+                except Exception:
+                    logging.exception("Could not dispatch webhook update.")
+                    self.send_response(500)
+                else:
+                    self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+server: Optional[WebhookServer] = None
+dispatcher_thread: Optional[threading.Thread] = None
+
+
+def start_dispatcher(updater: Updater) -> None:
+    global dispatcher_thread
+    updater.running = True
+    updater.job_queue.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher')
+    dispatcher_thread.start()
+
+
+def serve(handle: Callable[[Dict], None], bot: Bot) -> WebhookServer:
+    global server
+    server = WebhookServer(handle)
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    if URL:
+        kwargs = {'secret_token': SECRET} if SECRET else {}
+        bot.set_webhook(url=URL, **kwargs)
+    logging.info(f"Listening for webhook updates on {LISTEN}:{PORT}{server.url_path}.")
+    return server
+
+
+def start(updater: Updater) -> None:
+    start_dispatcher(updater)
+    serve(lambda data: updater.update_queue.put(Update.de_json(data, updater.bot)), updater.bot)
+
+
+def stop() -> None:
+    global server
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server = None
+    if dispatcher_thread is not None:
+        dispatcher_thread.join(timeout=5)